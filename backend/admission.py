@@ -0,0 +1,245 @@
+import asyncio
+import json
+import logging
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional, Tuple
+
+from pymongo import ReturnDocument
+from pymongo.errors import PyMongoError
+
+from metrics import observe_admission_rejected, observe_rate_limited, set_admission_load, set_admission_streams
+
+logger = logging.getLogger(__name__)
+
+class RateLimitBackend:
+    """Token-bucket state keyed by client.
+
+    The in-process backend limits each app process separately; the Mongo
+    backend is shared between processes and makes the limit global.
+    """
+
+    async def take(self, key: str, rate: float, burst: float) -> Tuple[bool, float]:
+        """Take one token; returns (allowed, seconds until a token is available)."""
+        raise NotImplementedError
+
+class MemoryRateLimitBackend(RateLimitBackend):
+    def __init__(self, max_keys: int = 100000):
+        self.max_keys = max_keys
+        # key -> (tokens, last refill); least recently seen keys are dropped
+        # first, which only ever resets a client to a full bucket.
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+
+    async def take(self, key: str, rate: float, burst: float) -> Tuple[bool, float]:
+        now = time.monotonic()
+        tokens, updated = self._buckets.get(key, (burst, now))
+        tokens = min(burst, tokens + (now - updated) * rate)
+        allowed = tokens >= 1
+        if allowed:
+            tokens -= 1
+        self._buckets[key] = (tokens, now)
+        self._buckets.move_to_end(key)
+        while len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+        return allowed, 0.0 if allowed else (1 - tokens) / rate
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+class MongoRateLimitBackend(RateLimitBackend):
+    """Buckets in a Mongo collection, shared by every app process.
+
+    Each take is one find_one_and_update whose update pipeline (MongoDB
+    4.2+) refills and takes atomically. Refill uses each process's wall
+    clock. A bucket expires (TTL index on ``expires_at``, see indexes.py)
+    once it would be full again. If Mongo can't be reached the request is
+    let through: the limiter shouldn't fail requests the database itself
+    would serve.
+    """
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    async def take(self, key: str, rate: float, burst: float) -> Tuple[bool, float]:
+        now = time.time()
+        elapsed = {"$max": [0, {"$subtract": [now, {"$ifNull": ["$updated", now]}]}]}
+        refilled = {"$min": [burst, {"$add": [{"$ifNull": ["$tokens", burst]}, {"$multiply": [elapsed, rate]}]}]}
+        try:
+            bucket = await self.collection.find_one_and_update(
+                {"_id": key},
+                [
+                    {"$set": {"tokens": refilled, "updated": now}},
+                    {"$set": {"allowed": {"$gte": ["$tokens", 1]}}},
+                    {"$set": {
+                        "tokens": {"$cond": ["$allowed", {"$subtract": ["$tokens", 1]}, "$tokens"]},
+                        "expires_at": datetime.now(timezone.utc) + timedelta(seconds=burst / rate),
+                    }},
+                ],
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+            )
+        except PyMongoError as e:
+            logger.warning(f"Rate limit check for {key} skipped: {e}")
+            return True, 0.0
+        if bucket["allowed"]:
+            return True, 0.0
+        return False, (1 - bucket["tokens"]) / rate
+
+class RateLimiter:
+    """``per_minute`` requests per client, with bursts of up to ``burst``.
+
+    A ``per_minute`` of 0 disables the limiter.
+    """
+
+    def __init__(self, name: str, per_minute: float, burst: float, backend: Optional[RateLimitBackend] = None):
+        self.name = name
+        self.rate = per_minute / 60.0
+        self.burst = max(1.0, burst)
+        self.backend = backend or MemoryRateLimitBackend()
+        self.allowed = 0
+        self.limited = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0
+
+    async def check(self, key: str) -> Tuple[bool, float]:
+        if not self.enabled:
+            return True, 0.0
+        allowed, retry_after = await self.backend.take(f"{self.name}:{key}", self.rate, self.burst)
+        if allowed:
+            self.allowed += 1
+        else:
+            self.limited += 1
+            observe_rate_limited(self.name)
+        return allowed, retry_after
+
+    def stats(self) -> Dict:
+        stats = {"per_minute": self.rate * 60, "burst": self.burst, "allowed": self.allowed, "limited": self.limited}
+        if isinstance(self.backend, MemoryRateLimitBackend):
+            stats["clients"] = len(self.backend)
+        return stats
+
+def client_key(scope, trusted_proxies: int = 0, by: str = "ip") -> str:
+    """The client a request counts against: its IP, or its Origin header.
+
+    Each of the ``trusted_proxies`` proxies in front of the app appends the
+    address it received the request from to X-Forwarded-For, so the client
+    is the ``trusted_proxies``-th entry from the right. Entries left of that
+    come from the caller and can't be trusted. With 0 (the default) the
+    header is ignored. Origin is set by the caller too; key by it only where
+    browsers are the clients that matter.
+    """
+    forwarded = []
+    origin = None
+    for name, value in scope.get("headers", []):
+        name = name.decode("latin-1").lower()
+        if name == "x-forwarded-for":
+            forwarded.extend(hop.strip() for hop in value.decode("latin-1").split(",") if hop.strip())
+        elif name == "origin":
+            origin = value.decode("latin-1")
+    if by == "origin" and origin:
+        return origin
+    if trusted_proxies > 0 and len(forwarded) >= trusted_proxies:
+        return forwarded[-trusted_proxies]
+    client = scope.get("client")
+    return client[0] if client else "unknown"
+
+class AdmissionControlMiddleware:
+    """Sheds load before the event loop and the Mongo pool saturate.
+
+    At most ``max_concurrency`` requests under ``path_prefix`` run at once.
+    Up to ``max_queue`` more wait (for at most ``queue_timeout`` seconds)
+    for a slot. Anything beyond gets a 503 with Retry-After straight away.
+    ``max_concurrency`` 0 disables it.
+
+    Long-lived streams (paths ending in ``stream_suffix``, the SSE payment
+    events) would hold request slots for their whole lifetime, so they are
+    counted separately: at most ``max_streams`` at once (0 for no limit),
+    without queueing.
+    """
+
+    def __init__(
+        self,
+        app,
+        max_concurrency: int = 0,
+        max_queue: int = 0,
+        queue_timeout: float = 5.0,
+        path_prefix: str = "/api",
+        stream_suffix: str = "/events",
+        max_streams: int = 0,
+    ):
+        self.app = app
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.path_prefix = path_prefix
+        self.stream_suffix = stream_suffix
+        self.max_streams = max_streams
+        self._semaphore = asyncio.Semaphore(max_concurrency) if max_concurrency > 0 else None
+        self.in_flight = 0
+        self.queued = 0
+        self.streams = 0
+
+    async def _reject(self, send, reason: str) -> None:
+        observe_admission_rejected(reason)
+        body = json.dumps({"detail": "Server busy, please retry"}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 503,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", b"1"),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+    async def _stream(self, scope, receive, send) -> None:
+        if self.max_streams and self.streams >= self.max_streams:
+            await self._reject(send, "streams_full")
+            return
+        self.streams += 1
+        set_admission_streams(self.streams)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.streams -= 1
+            set_admission_streams(self.streams)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith(self.path_prefix):
+            await self.app(scope, receive, send)
+            return
+        if self.stream_suffix and scope["path"].endswith(self.stream_suffix):
+            await self._stream(scope, receive, send)
+            return
+        if self._semaphore is None:
+            await self.app(scope, receive, send)
+            return
+
+        if self._semaphore.locked():
+            if self.queued >= self.max_queue:
+                await self._reject(send, "queue_full")
+                return
+            self.queued += 1
+            set_admission_load(self.in_flight, self.queued)
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), timeout=self.queue_timeout)
+            except asyncio.TimeoutError:
+                await self._reject(send, "queue_timeout")
+                return
+            finally:
+                self.queued -= 1
+        else:
+            await self._semaphore.acquire()
+
+        self.in_flight += 1
+        set_admission_load(self.in_flight, self.queued)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.in_flight -= 1
+            self._semaphore.release()
+            set_admission_load(self.in_flight, self.queued)
@@ -0,0 +1,55 @@
+from typing import Dict, List, Optional, Union
+
+from pydantic import BaseModel, ConfigDict
+
+# Response models for the hot routes. FastAPI validates and serializes the
+# returned dicts through pydantic-core with these instead of walking them
+# with jsonable_encoder, and the app's ORJSONResponse writes the bytes.
+
+class TeaserResults(BaseModel):
+    scores: Dict[str, Union[int, str]]
+    label: str
+    primary: str
+    mods: List[str]
+    attach: str
+    teaser_what: str
+    teaser_tip: str
+
+class FullResults(BaseModel):
+    # Modifier flags (picker, volcano, ...) are named by the scoring spec.
+    model_config = ConfigDict(extra="allow")
+
+    scores: Dict[str, Union[int, str]]
+    label: str
+    primary: str
+    mods: List[str]
+    attach: str
+    what: str
+    steps: List[str]
+    script: str
+
+class QuizSubmitResponse(BaseModel):
+    result_id: str
+    teaser: TeaserResults
+    is_paid: bool
+
+class QuizBatchSubmitResponse(BaseModel):
+    count: int
+    result_ids: List[str]
+
+class ResultResponse(BaseModel):
+    # Exactly one of teaser/results is set; the route drops the other.
+    result_id: str
+    is_paid: bool
+    teaser: Optional[TeaserResults] = None
+    results: Optional[FullResults] = None
+
+class CheckoutSessionCreated(BaseModel):
+    url: str
+    session_id: str
+
+class PaymentStatusResponse(BaseModel):
+    status: str
+    payment_status: str
+    amount_total: int
+    currency: str
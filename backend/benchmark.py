@@ -0,0 +1,374 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+import timeit
+import uuid
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+ROOT_DIR = Path(__file__).parent
+# Baselines are machine-specific: the committed ones come from one
+# development machine, so elsewhere record your own (--update-baseline on the
+# base branch) before comparing. Keys starting with "_" are notes.
+BASELINE_FILE = ROOT_DIR / "benchmark_baselines.json"
+
+# Relative weights of the traffic mix; roughly what a day of real traffic
+# looks like (most visitors read their results, a few pay).
+TRAFFIC_MIX = {
+    "questions": 2,
+    "submit": 4,
+    "results": 10,
+    "checkout": 2,
+    "status": 3,
+    "webhook": 1,
+}
+DEFAULT_CONCURRENCY = (1, 8, 32)
+# All load comes from one client, so per-client rate limits are switched off;
+# admission control stays on as configured.
+LOAD_TEST_ENV = {
+    "PAYMENT_GATEWAY": "fake",
+    "RATE_LIMIT_SUBMIT_PER_MINUTE": "0",
+    "RATE_LIMIT_CHECKOUT_PER_MINUTE": "0",
+}
+SEED_RESULTS = 50
+
+def percentile(samples: List[float], pct: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+def summarize(samples: List[float], elapsed: float) -> Dict[str, float]:
+    return {
+        "requests": len(samples),
+        "throughput": round(len(samples) / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(percentile(samples, 50) * 1000, 2),
+        "p95_ms": round(percentile(samples, 95) * 1000, 2),
+        "p99_ms": round(percentile(samples, 99) * 1000, 2),
+    }
+
+def random_answers(count: int = 25) -> List[int]:
+    return [random.randint(1, 5) for _ in range(count)]
+
+# --- microbenchmarks -------------------------------------------------------
+
+def _time_call(fn: Callable[[], object], repeat: int) -> Dict[str, float]:
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    best = min(timer.repeat(repeat=repeat, number=number)) / number
+    return {"us_per_call": round(best * 1e6, 3), "throughput": round(1 / best, 1)}
+
+def run_microbenchmarks(repeat: int = 5) -> Dict[str, Dict[str, float]]:
+    from fastapi.encoders import jsonable_encoder
+    from fastapi.responses import JSONResponse, ORJSONResponse
+    from pydantic import TypeAdapter
+
+    from api_models import ResultResponse
+    from scoring import build_blocks, compute_full_results, compute_scores, default_registry
+
+    engine = default_registry().current
+    random.seed(7)
+    answers = [random_answers(engine.question_count) for _ in range(256)]
+    primaries = list(engine.spec["archetypes"])
+    cycle = {"i": 0}
+
+    def next_answers():
+        cycle["i"] = (cycle["i"] + 1) % len(answers)
+        return answers[cycle["i"]]
+
+    # GET /results for a paid result, rendered the way FastAPI does without
+    # a response model (default) and with ResultResponse + ORJSONResponse.
+    payload = {"result_id": str(uuid.uuid4()), "is_paid": True, "results": engine.score(answers[0]).full}
+    adapter = TypeAdapter(ResultResponse)
+
+    def render_fast():
+        model = adapter.validate_python(payload)
+        return ORJSONResponse(adapter.dump_python(model, mode="json", exclude_none=True))
+
+    return {
+        "compute_scores": _time_call(lambda: compute_scores(next_answers()), repeat),
+        "compute_full_results": _time_call(lambda: compute_full_results(next_answers()), repeat),
+        "build_blocks": _time_call(
+            lambda: build_blocks(primaries[cycle["i"] % len(primaries)], cycle["i"] & 1 == 0, cycle["i"] & 2 == 0),
+            repeat
+        ),
+        "results_response_default": _time_call(lambda: JSONResponse(jsonable_encoder(payload)), repeat),
+        "results_response_fast": _time_call(render_fast, repeat),
+    }
+
+# --- load test -------------------------------------------------------------
+
+class TrafficState:
+    """Ids created during the run that later requests refer back to."""
+
+    def __init__(self):
+        self.result_ids: List[str] = []
+        self.sessions: List[Tuple[str, str]] = []
+
+async def _submit(client, state: TrafficState):
+    response = await client.post("/api/quiz/submit", json={"answers": random_answers()})
+    if response.status_code == 200:
+        state.result_ids.append(response.json()["result_id"])
+    return response
+
+async def _questions(client, state: TrafficState):
+    return await client.get("/api/quiz/questions")
+
+async def _results(client, state: TrafficState):
+    return await client.get(f"/api/results/{random.choice(state.result_ids)}")
+
+async def _checkout(client, state: TrafficState):
+    result_id = random.choice(state.result_ids)
+    response = await client.post(
+        "/api/checkout/session",
+        json={"result_id": result_id, "origin_url": "http://localhost:3000"}
+    )
+    if response.status_code == 200:
+        state.sessions.append((result_id, response.json()["session_id"]))
+    return response
+
+async def _status(client, state: TrafficState):
+    if not state.sessions:
+        return await _checkout(client, state)
+    _, session_id = random.choice(state.sessions)
+    return await client.get(f"/api/checkout/status/{session_id}")
+
+async def _webhook(client, state: TrafficState):
+    if not state.sessions:
+        return await _checkout(client, state)
+    result_id, session_id = random.choice(state.sessions)
+    # FakePaymentGateway accepts unsigned JSON events.
+    event = {
+        "event_type": "checkout.session.completed",
+        "event_id": f"evt_{uuid.uuid4().hex}",
+        "session_id": session_id,
+        "payment_status": "paid",
+        "metadata": {"result_id": result_id},
+    }
+    return await client.post("/api/webhook/stripe", content=json.dumps(event))
+
+OPERATIONS = {
+    "questions": _questions,
+    "submit": _submit,
+    "results": _results,
+    "checkout": _checkout,
+    "status": _status,
+    "webhook": _webhook,
+}
+
+async def run_load_level(client, state: TrafficState, concurrency: int, duration: float) -> Dict:
+    names = list(TRAFFIC_MIX)
+    weights = [TRAFFIC_MIX[name] for name in names]
+    latencies: Dict[str, List[float]] = {name: [] for name in names}
+    errors: Dict[str, int] = {}
+    deadline = time.perf_counter() + duration
+
+    async def worker():
+        while time.perf_counter() < deadline:
+            name = random.choices(names, weights)[0]
+            start = time.perf_counter()
+            try:
+                response = await OPERATIONS[name](client, state)
+                failed = response.status_code >= 500
+            except Exception:
+                failed = True
+            latencies[name].append(time.perf_counter() - start)
+            if failed:
+                errors[name] = errors.get(name, 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    report = {"all": summarize([s for samples in latencies.values() for s in samples], elapsed)}
+    for name, samples in latencies.items():
+        report[name] = summarize(samples, elapsed)
+    report["errors"] = errors
+    return report
+
+async def run_load(client, levels: List[int], duration: float) -> Dict[str, Dict]:
+    state = TrafficState()
+    for _ in range(SEED_RESULTS):
+        response = await _submit(client, state)
+        response.raise_for_status()
+    # One short untimed pass so connection pools and caches are warm.
+    await run_load_level(client, state, max(levels), min(duration, 1.0))
+    return {f"c{level}": await run_load_level(client, state, level, duration) for level in levels}
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+async def load_against_server(levels: List[int], duration: float, url: Optional[str]) -> Dict:
+    """Run the mix against ``url``, or a uvicorn server started on local Mongo."""
+    import httpx
+
+    process = None
+    db_name = None
+    if url is None:
+        db_name = f"benchmark_{uuid.uuid4().hex[:8]}"
+        port = _free_port()
+        url = f"http://127.0.0.1:{port}"
+        env = dict(os.environ, **LOAD_TEST_ENV, DB_NAME=db_name)
+        env.setdefault("MONGO_URL", "mongodb://localhost:27017")
+        process = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "server:app", "--port", str(port), "--log-level", "warning"],
+            cwd=ROOT_DIR,
+            env=env,
+        )
+
+    limits = httpx.Limits(max_connections=max(levels), max_keepalive_connections=max(levels))
+    try:
+        async with httpx.AsyncClient(base_url=url, limits=limits, timeout=30) as client:
+            for _ in range(100):
+                try:
+                    if (await client.get("/api/")).status_code == 200:
+                        break
+                except httpx.TransportError:
+                    pass
+                if process is not None and process.poll() is not None:
+                    raise RuntimeError("server exited during startup")
+                await asyncio.sleep(0.1)
+            else:
+                raise RuntimeError(f"server at {url} did not become ready")
+            return await run_load(client, levels, duration)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=10)
+            from pymongo import MongoClient
+            mongo = MongoClient(os.environ.get("MONGO_URL", "mongodb://localhost:27017"))
+            mongo.drop_database(db_name)
+            mongo.close()
+
+async def load_in_memory(levels: List[int], duration: float) -> Dict:
+    """Run the mix in-process against an in-memory Motor stand-in.
+
+    Needs ``mongomock-motor``. Client and app share one event loop, so the
+    numbers are only comparable with other in-memory runs.
+    """
+    import httpx
+    import motor.motor_asyncio
+    from mongomock_motor import AsyncMongoMockClient
+
+    motor.motor_asyncio.AsyncIOMotorClient = AsyncMongoMockClient
+    os.environ.update(LOAD_TEST_ENV)
+    os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+    os.environ["DB_NAME"] = "benchmark"
+    sys.path.insert(0, str(ROOT_DIR))
+    import server
+
+    transport = httpx.ASGITransport(app=server.app)
+    async with server.app.router.lifespan_context(server.app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+            return await run_load(client, levels, duration)
+
+# --- baselines -------------------------------------------------------------
+
+def flatten(report: Dict) -> Dict[str, Dict[str, float]]:
+    """Map ``section.name`` to the numbers that are compared to baselines."""
+    flat = {}
+    for name, numbers in report.get("micro", {}).items():
+        flat[f"micro.{name}"] = numbers
+    mode = report.get("mode")
+    for level, ops in report.get("load", {}).items():
+        for name, numbers in ops.items():
+            if name != "errors":
+                flat[f"load.{mode}.{level}.{name}"] = numbers
+    return flat
+
+def compare(report: Dict, baselines: Dict, tolerance: float) -> List[str]:
+    regressions = []
+    for level, ops in report.get("load", {}).items():
+        for name, count in ops["errors"].items():
+            regressions.append(f"load.{report['mode']}.{level}.{name}: {count} server errors")
+    for key, numbers in flatten(report).items():
+        baseline = baselines.get(key)
+        if not baseline:
+            continue
+        if numbers["throughput"] < baseline["throughput"] * (1 - tolerance):
+            regressions.append(f"{key}: throughput {numbers['throughput']} < baseline {baseline['throughput']}")
+        for latency in ("us_per_call", "p95_ms"):
+            if latency in baseline and numbers[latency] > baseline[latency] * (1 + tolerance):
+                regressions.append(f"{key}: {latency} {numbers[latency]} > baseline {baseline[latency]}")
+    return regressions
+
+def load_baselines(path: Path) -> Dict:
+    if not path.exists():
+        return {}
+    return json.loads(path.read_text())
+
+def save_baselines(path: Path, report: Dict) -> None:
+    baselines = load_baselines(path)
+    for key, numbers in flatten(report).items():
+        baselines[key] = {k: v for k, v in numbers.items() if k in ("throughput", "us_per_call", "p95_ms")}
+    path.write_text(json.dumps(baselines, indent=2, sort_keys=True) + "\n")
+
+def print_report(report: Dict) -> None:
+    for name, numbers in report.get("micro", {}).items():
+        print(f"{name:>24}: {numbers['us_per_call']:>9} us/call  {numbers['throughput']:>12} calls/s")
+    for level, ops in report.get("load", {}).items():
+        print(f"-- {report['mode']} concurrency {level[1:]} --")
+        for name, numbers in ops.items():
+            if name == "errors":
+                continue
+            print(
+                f"{name:>12}: {numbers['requests']:>6} req  {numbers['throughput']:>8} req/s  "
+                f"p50 {numbers['p50_ms']:>7} ms  p95 {numbers['p95_ms']:>7} ms  p99 {numbers['p99_ms']:>7} ms"
+            )
+        if ops["errors"]:
+            print(f"      errors: {ops['errors']}")
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Scoring microbenchmarks and API load test")
+    parser.add_argument("--micro-only", action="store_true", help="skip the load test")
+    parser.add_argument("--load-only", action="store_true", help="skip the microbenchmarks")
+    parser.add_argument("--in-memory", action="store_true", help="use an in-memory Mongo stand-in (mongomock-motor)")
+    parser.add_argument("--url", help="benchmark an already running server instead of starting one")
+    parser.add_argument("--concurrency", default=",".join(map(str, DEFAULT_CONCURRENCY)))
+    parser.add_argument("--duration", type=float, default=5.0, help="seconds per concurrency level")
+    parser.add_argument("--baseline", type=Path, default=BASELINE_FILE)
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed regression as a fraction")
+    parser.add_argument("--update-baseline", action="store_true", help="record this run as the new baseline")
+    parser.add_argument("--json", action="store_true", help="print the raw report as JSON")
+    args = parser.parse_args()
+
+    load_dotenv(ROOT_DIR / '.env')
+    levels = [int(level) for level in args.concurrency.split(",")]
+    report: Dict = {"mode": "in-memory" if args.in_memory else "server"}
+    if not args.load_only:
+        report["micro"] = run_microbenchmarks()
+    if not args.micro_only:
+        if args.in_memory:
+            report["load"] = asyncio.run(load_in_memory(levels, args.duration))
+        else:
+            report["load"] = asyncio.run(load_against_server(levels, args.duration, args.url))
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+    if args.update_baseline:
+        save_baselines(args.baseline, report)
+        print(f"Baseline written to {args.baseline}")
+        return 0
+
+    regressions = compare(report, load_baselines(args.baseline), args.tolerance)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.path.insert(0, str(ROOT_DIR))
+    sys.exit(main())
@@ -0,0 +1,348 @@
+import asyncio
+import html
+import logging
+import random
+import smtplib
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from email.message import EmailMessage
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+class PermanentEmailError(Exception):
+    """The message will never be accepted (bad address, 5xx); don't retry."""
+
+class EmailTransport:
+    async def send(self, message: EmailMessage) -> None:
+        raise NotImplementedError
+
+    async def close(self) -> None:
+        pass
+
+class LogTransport(EmailTransport):
+    # Used when no SMTP server is configured: nothing leaves the process.
+    async def send(self, message: EmailMessage) -> None:
+        logger.info(f"Email to {message['To']} not sent (no SMTP configured): {message['Subject']}")
+
+class SMTPTransport(EmailTransport):
+    """smtplib behind a small connection pool, run in worker threads.
+
+    Idle connections are kept open and reused; ``max_per_second`` spaces out
+    sends across all workers.
+    """
+
+    def __init__(
+        self,
+        host: str,
+        port: int = 587,
+        username: Optional[str] = None,
+        password: Optional[str] = None,
+        starttls: bool = True,
+        timeout: float = 30.0,
+        max_per_second: Optional[float] = None,
+    ):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.timeout = timeout
+        self.max_per_second = max_per_second
+        self._idle: List[smtplib.SMTP] = []
+        self._throttle_lock = asyncio.Lock()
+        self._next_slot = 0.0
+
+    @staticmethod
+    def _discard(connection: smtplib.SMTP) -> None:
+        try:
+            connection.quit()
+        except (smtplib.SMTPException, OSError):
+            connection.close()
+
+    def _connect(self) -> smtplib.SMTP:
+        connection = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            if self.starttls:
+                connection.starttls()
+            if self.username:
+                connection.login(self.username, self.password or "")
+        except BaseException:
+            self._discard(connection)
+            raise
+        return connection
+
+    def _send_blocking(self, connection: Optional[smtplib.SMTP], message: EmailMessage) -> smtplib.SMTP:
+        # A connection that saw an error is closed, not returned to the pool.
+        if connection is not None:
+            try:
+                connection.send_message(message)
+                return connection
+            except smtplib.SMTPServerDisconnected:
+                self._discard(connection)
+            except BaseException:
+                self._discard(connection)
+                raise
+        connection = self._connect()
+        try:
+            connection.send_message(message)
+        except BaseException:
+            self._discard(connection)
+            raise
+        return connection
+
+    async def _throttle(self) -> None:
+        if not self.max_per_second:
+            return
+        loop = asyncio.get_running_loop()
+        async with self._throttle_lock:
+            now = loop.time()
+            delay = self._next_slot - now
+            self._next_slot = max(now, self._next_slot) + 1 / self.max_per_second
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def send(self, message: EmailMessage) -> None:
+        await self._throttle()
+        connection = self._idle.pop() if self._idle else None
+        try:
+            connection = await asyncio.to_thread(self._send_blocking, connection, message)
+        except (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused) as e:
+            raise PermanentEmailError(str(e))
+        except smtplib.SMTPResponseException as e:
+            if 500 <= e.smtp_code < 600:
+                raise PermanentEmailError(f"{e.smtp_code} {e.smtp_error!r}")
+            raise
+        self._idle.append(connection)
+
+    async def close(self) -> None:
+        idle, self._idle = self._idle, []
+        for connection in idle:
+            try:
+                await asyncio.to_thread(connection.quit)
+            except (smtplib.SMTPException, OSError):
+                pass
+
+def create_email_transport(settings: Dict[str, str]) -> EmailTransport:
+    host = settings.get("SMTP_HOST")
+    if not host:
+        return LogTransport()
+    rate = settings.get("SMTP_MAX_PER_SECOND")
+    return SMTPTransport(
+        host=host,
+        port=int(settings.get("SMTP_PORT", "587")),
+        username=settings.get("SMTP_USERNAME"),
+        password=settings.get("SMTP_PASSWORD"),
+        starttls=settings.get("SMTP_STARTTLS", "true").lower() in ("1", "true", "yes"),
+        max_per_second=float(rate) if rate else None,
+    )
+
+def render_results_email(full: Dict, results_url: Optional[str] = None) -> Tuple[str, str, str]:
+    """Subject, plain-text and HTML bodies for a full-results email."""
+    subject = f"Your Love Life Debugger results: {full['label']}"
+    scores = full["scores"]
+    score_lines = [
+        f"{key.upper()}: {value} ({scores.get(f'{key}_tag', '')})"
+        for key, value in scores.items() if not key.endswith("_tag")
+    ]
+    text = [subject, "", full["what"], "", "Your scores:", *score_lines, "", "What to do next:"]
+    text += [f"{i}. {step}" for i, step in enumerate(full["steps"], 1)]
+    text += ["", "Try saying:", full["script"]]
+    if results_url:
+        text += ["", f"View your results: {results_url}"]
+
+    e = html.escape
+    body = [f"<h1>{e(full['label'])}</h1>", f"<p>{e(full['what'])}</p>", "<h2>Your scores</h2><ul>"]
+    body += [f"<li>{e(line)}</li>" for line in score_lines]
+    body += ["</ul><h2>What to do next</h2><ol>"]
+    body += [f"<li>{e(step)}</li>" for step in full["steps"]]
+    body += ["</ol><h2>Try saying</h2>", f"<blockquote>{e(full['script'])}</blockquote>"]
+    if results_url:
+        body.append(f'<p><a href="{e(results_url)}">View your results</a></p>')
+    return subject, "\n".join(text), "\n".join(body)
+
+def _iso(moment: datetime) -> str:
+    return moment.isoformat()
+
+class EmailOutbox:
+    """Durable email queue in ``email_outbox`` drained by async workers.
+
+    ``enqueue`` is a single insert. Workers claim due messages with
+    ``find_one_and_update`` (a claim is a lease, so messages held by a
+    crashed process become due again), render the email once per result,
+    send through the transport and retry failures with exponential backoff
+    up to ``max_attempts``.
+    """
+
+    def __init__(
+        self,
+        db,
+        transport: EmailTransport,
+        load_payload: Callable[[str], Awaitable[Optional[Dict]]],
+        on_sent: Callable[[Dict], Awaitable[None]],
+        sender: str,
+        results_url: Optional[str] = None,
+        workers: int = 2,
+        max_attempts: int = 5,
+        base_backoff: float = 30.0,
+        max_backoff: float = 3600.0,
+        lease_seconds: float = 300.0,
+        poll_interval: float = 5.0,
+        render_cache_size: int = 1000,
+    ):
+        self.db = db
+        self.transport = transport
+        self.load_payload = load_payload
+        self.on_sent = on_sent
+        self.sender = sender
+        self.results_url = results_url
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.render_cache_size = render_cache_size
+        self._rendered: "OrderedDict[str, Tuple[str, str, str]]" = OrderedDict()
+        self._wake = asyncio.Event()
+        self._tasks: List[asyncio.Task] = []
+        self.enqueued = 0
+        self.sent = 0
+        self.retries = 0
+        self.failed = 0
+
+    async def start(self) -> None:
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        await self.transport.close()
+
+    async def enqueue(self, result_id: str, to: str) -> str:
+        now = _iso(datetime.now(timezone.utc))
+        message_id = str(uuid.uuid4())
+        await self.db.email_outbox.insert_one({
+            "id": message_id,
+            "result_id": result_id,
+            "to": to,
+            "status": "pending",
+            "attempts": 0,
+            "next_attempt_at": now,
+            "created_at": now
+        })
+        self.enqueued += 1
+        self._wake.set()
+        return message_id
+
+    async def _claim(self) -> Optional[Dict]:
+        now = datetime.now(timezone.utc)
+        return await self.db.email_outbox.find_one_and_update(
+            {
+                "$or": [
+                    {"status": "pending", "next_attempt_at": {"$lte": _iso(now)}},
+                    {"status": "sending", "lease_until": {"$lte": _iso(now)}},
+                ]
+            },
+            {"$set": {
+                "status": "sending",
+                "lease_until": _iso(now + timedelta(seconds=self.lease_seconds))
+            }},
+            sort=[("next_attempt_at", 1)],
+            projection={"_id": 0}
+        )
+
+    async def _worker(self) -> None:
+        while True:
+            try:
+                job = await self._claim()
+            except Exception as e:
+                logger.error(f"Email outbox claim failed: {e}")
+                job = None
+            if job is None:
+                self._wake.clear()
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            try:
+                await self._deliver(job)
+            except Exception as e:
+                # The lease runs out and another attempt picks the job up.
+                logger.error(f"Email {job['id']} could not be recorded: {e}")
+
+    async def _render(self, result_id: str) -> Optional[Tuple[str, str, str]]:
+        rendered = self._rendered.get(result_id)
+        if rendered is not None:
+            self._rendered.move_to_end(result_id)
+            return rendered
+        full = await self.load_payload(result_id)
+        if full is None:
+            return None
+        url = f"{self.results_url.rstrip('/')}/results/{result_id}" if self.results_url else None
+        rendered = render_results_email(full, url)
+        self._rendered[result_id] = rendered
+        while len(self._rendered) > self.render_cache_size:
+            self._rendered.popitem(last=False)
+        return rendered
+
+    async def _deliver(self, job: Dict) -> None:
+        try:
+            rendered = await self._render(job["result_id"])
+            if rendered is None:
+                raise PermanentEmailError("Result not found or not unlocked")
+            subject, text, body = rendered
+            message = EmailMessage()
+            try:
+                message["From"] = self.sender
+                message["To"] = job["to"]
+                message["Subject"] = subject
+            except ValueError as e:
+                # CR/LF in an address: retrying can't make it a valid header.
+                raise PermanentEmailError(f"Invalid header: {e}")
+            message.set_content(text)
+            message.add_alternative(body, subtype="html")
+            await self.transport.send(message)
+        except Exception as e:
+            await self._failed(job, e)
+            return
+
+        now = _iso(datetime.now(timezone.utc))
+        await self.db.email_outbox.update_one(
+            {"id": job["id"]},
+            {"$set": {"status": "sent", "sent_at": now}, "$unset": {"lease_until": ""}}
+        )
+        self.sent += 1
+        await self.on_sent({**job, "sent_at": now})
+
+    async def _failed(self, job: Dict, error: Exception) -> None:
+        attempts = job["attempts"] + 1
+        update = {"attempts": attempts, "last_error": str(error)[:500]}
+        if isinstance(error, PermanentEmailError) or attempts >= self.max_attempts:
+            update["status"] = "failed"
+            self.failed += 1
+            logger.error(f"Giving up on email {job['id']} to {job['to']!r} after {attempts} attempts: {error}")
+        else:
+            delay = min(self.max_backoff, self.base_backoff * 2 ** (attempts - 1))
+            delay *= random.uniform(0.8, 1.2)
+            update["status"] = "pending"
+            update["next_attempt_at"] = _iso(datetime.now(timezone.utc) + timedelta(seconds=delay))
+            self.retries += 1
+            logger.warning(f"Email {job['id']} failed (attempt {attempts}), retrying in {delay:.0f}s: {error}")
+        await self.db.email_outbox.update_one(
+            {"id": job["id"]},
+            {"$set": update, "$unset": {"lease_until": ""}}
+        )
+
+    def stats(self) -> Dict:
+        return {
+            "enqueued": self.enqueued,
+            "sent": self.sent,
+            "retries": self.retries,
+            "failed": self.failed,
+            "rendered_cached": len(self._rendered),
+        }
@@ -0,0 +1,198 @@
+import argparse
+import asyncio
+import csv
+import io
+import json
+import os
+import sys
+import zlib
+from datetime import datetime
+from pathlib import Path
+from typing import AsyncIterator, Dict, List, Optional
+
+from dotenv import load_dotenv
+
+from result_format import LEGACY_SCORING_VERSION
+from scoring import ScoringRegistry, default_registry
+
+# Streaming export of quiz_results for analytics. Documents come off a Motor
+# cursor one batch at a time and leave as encoded chunks, so memory stays
+# flat however many rows are exported.
+BASE_COLUMNS = ["id", "created_at", "is_paid", "paid_at", "scoring_version", "label", "primary", "attach", "mods"]
+OPTIONAL_COLUMNS = ["email", "emailed_at"]
+CURSOR_BATCH_SIZE = 1000
+CHUNK_BYTES = 64 * 1024
+
+def score_columns(registry: ScoringRegistry) -> List[str]:
+    columns = []
+    for version in registry.versions:
+        for key in registry.get(version).score_keys:
+            for column in (f"scores.{key}", f"scores.{key}_tag"):
+                if column not in columns:
+                    columns.append(column)
+    return columns
+
+def export_columns(registry: ScoringRegistry, include: Optional[List[str]] = None) -> List[str]:
+    columns = BASE_COLUMNS + score_columns(registry)
+    for column in include or []:
+        if column not in OPTIONAL_COLUMNS:
+            raise ValueError(f"Unknown export column {column}")
+        columns.append(column)
+    return columns
+
+def export_query(since: Optional[str] = None, until: Optional[str] = None, paid: Optional[bool] = None) -> Dict:
+    # created_at is stored as an ISO-8601 UTC string, so string bounds
+    # compare chronologically and use the created_at index.
+    query: Dict = {}
+    for bound in (since, until):
+        if bound:
+            datetime.fromisoformat(bound)
+    if since or until:
+        query["created_at"] = {}
+        if since:
+            query["created_at"]["$gte"] = since
+        if until:
+            query["created_at"]["$lt"] = until
+    if paid is not None:
+        query["is_paid"] = True if paid else {"$ne": True}
+    return query
+
+def export_projection(columns: List[str]) -> Dict:
+    projection = {"_id": 0, "scoring_version": 1, "sums": 1, "teaser_results": 1}
+    for column in columns:
+        if column in ("id", "created_at", "is_paid", "paid_at") or column in OPTIONAL_COLUMNS:
+            projection[column] = 1
+    return projection
+
+def flatten_result(doc: Dict, registry: ScoringRegistry, columns: List[str]) -> Dict:
+    # Only the teaser is projected; legacy documents carry it themselves.
+    if "teaser_results" in doc:
+        teaser = doc["teaser_results"]
+    else:
+        teaser = registry.get(doc["scoring_version"]).lookup(doc["sums"]).teaser
+    row = {
+        **{key: doc.get(key) for key in columns if key in doc},
+        "scoring_version": doc.get("scoring_version", LEGACY_SCORING_VERSION),
+        "label": teaser["label"],
+        "primary": teaser["primary"],
+        "attach": teaser["attach"],
+        "mods": list(teaser["mods"]),
+        "is_paid": bool(doc.get("is_paid")),
+    }
+    for key, value in teaser["scores"].items():
+        row[f"scores.{key}"] = value
+    return {column: row.get(column) for column in columns}
+
+async def export_rows(
+    db,
+    registry: ScoringRegistry,
+    columns: List[str],
+    query: Dict,
+    limit: int = 0,
+) -> AsyncIterator[Dict]:
+    cursor = db.quiz_results.find(
+        query,
+        export_projection(columns),
+        batch_size=CURSOR_BATCH_SIZE,
+        limit=limit
+    ).sort("created_at", 1)
+    async for doc in cursor:
+        yield flatten_result(doc, registry, columns)
+
+async def ndjson_chunks(rows: AsyncIterator[Dict]) -> AsyncIterator[bytes]:
+    buffer = io.BytesIO()
+    async for row in rows:
+        buffer.write(json.dumps(row, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+        buffer.write(b"\n")
+        if buffer.tell() >= CHUNK_BYTES:
+            yield buffer.getvalue()
+            buffer = io.BytesIO()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+async def csv_chunks(rows: AsyncIterator[Dict], columns: List[str]) -> AsyncIterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    async for row in rows:
+        writer.writerow(
+            "|".join(value) if isinstance(value, list) else ("" if value is None else value)
+            for value in row.values()
+        )
+        if buffer.tell() >= CHUNK_BYTES:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+async def gzip_chunks(chunks: AsyncIterator[bytes], level: int = 6) -> AsyncIterator[bytes]:
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    async for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+def export_stream(
+    db,
+    registry: ScoringRegistry,
+    fmt: str = "ndjson",
+    compress: bool = False,
+    include: Optional[List[str]] = None,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    paid: Optional[bool] = None,
+    limit: int = 0,
+) -> AsyncIterator[bytes]:
+    """Encoded export chunks.
+
+    Arguments are checked before the first document is read; a bad format,
+    column or date raises ValueError here rather than mid-stream.
+    """
+    if fmt not in ("ndjson", "csv"):
+        raise ValueError("format must be ndjson or csv")
+    columns = export_columns(registry, include)
+    rows = export_rows(db, registry, columns, export_query(since, until, paid), limit)
+    chunks = csv_chunks(rows, columns) if fmt == "csv" else ndjson_chunks(rows)
+    return gzip_chunks(chunks) if compress else chunks
+
+async def main() -> None:
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    parser = argparse.ArgumentParser(description="Export quiz results as NDJSON or CSV")
+    parser.add_argument("--format", choices=("ndjson", "csv"), default="ndjson")
+    parser.add_argument("--since", help="created_at lower bound (ISO date, inclusive)")
+    parser.add_argument("--until", help="created_at upper bound (ISO date, exclusive)")
+    parser.add_argument("--paid", choices=("true", "false"), help="only paid or unpaid results")
+    parser.add_argument("--include", action="append", choices=OPTIONAL_COLUMNS, help="extra column (repeatable)")
+    parser.add_argument("--limit", type=int, default=0)
+    parser.add_argument("--gzip", action="store_true")
+    parser.add_argument("-o", "--output", help="output file (default: stdout)")
+    args = parser.parse_args()
+
+    load_dotenv(Path(__file__).parent / '.env')
+    client = AsyncIOMotorClient(os.environ["MONGO_URL"])
+    db = client[os.environ["DB_NAME"]]
+    out = open(args.output, "wb") if args.output else sys.stdout.buffer
+    try:
+        chunks = export_stream(
+            db,
+            default_registry(),
+            fmt=args.format,
+            compress=args.gzip,
+            include=args.include,
+            since=args.since,
+            until=args.until,
+            paid=None if args.paid is None else args.paid == "true",
+            limit=args.limit,
+        )
+        async for chunk in chunks:
+            out.write(chunk)
+    finally:
+        if args.output:
+            out.close()
+        client.close()
+
+if __name__ == "__main__":
+    asyncio.run(main())
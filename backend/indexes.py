@@ -0,0 +1,115 @@
+import asyncio
+import logging
+import os
+import sys
+from pathlib import Path
+from typing import Dict, Iterator, List, Tuple
+
+from dotenv import load_dotenv
+from pymongo import ASCENDING, IndexModel
+from pymongo.errors import OperationFailure
+
+logger = logging.getLogger(__name__)
+
+# Indexes every collection needs. create_indexes is a no-op for indexes that
+# already exist with the same spec, so this is safe to apply on every start.
+INDEXES: Dict[str, List[IndexModel]] = {
+    "quiz_results": [
+        IndexModel([("id", ASCENDING)], unique=True, name="id_unique"),
+        IndexModel([("created_at", ASCENDING)], name="created_at"),
+        IndexModel([("is_paid", ASCENDING), ("created_at", ASCENDING)], name="is_paid_created_at"),
+    ],
+    "payment_transactions": [
+        IndexModel([("session_id", ASCENDING)], unique=True, name="session_id_unique"),
+        IndexModel([("result_id", ASCENDING)], name="result_id"),
+        IndexModel([("payment_status", ASCENDING), ("created_at", ASCENDING)], name="payment_status_created_at"),
+    ],
+    "rate_limits": [
+        IndexModel([("expires_at", ASCENDING)], expireAfterSeconds=0, name="expires_at_ttl"),
+    ],
+    "webhook_events": [
+        IndexModel([("event_id", ASCENDING)], unique=True, name="event_id_unique"),
+        IndexModel([("status", ASCENDING)], name="status"),
+    ],
+    "email_outbox": [
+        IndexModel([("id", ASCENDING)], unique=True, name="id_unique"),
+        IndexModel([("status", ASCENDING), ("next_attempt_at", ASCENDING)], name="status_next_attempt_at"),
+        IndexModel([("status", ASCENDING), ("lease_until", ASCENDING)], name="status_lease_until"),
+    ],
+}
+
+# The filters the routes and workers issue, checked by verify_query_plans.
+# Values only need the right type; the plan doesn't depend on them.
+ROUTE_QUERIES: List[Tuple[str, str, Dict]] = [
+    ("GET /results/{id}", "quiz_results", {"id": "probe"}),
+    ("result retention", "quiz_results", {
+        "is_paid": {"$ne": True},
+        "created_at": {"$lt": "probe"},
+        "$or": [{"checkout_started_at": {"$exists": False}}, {"checkout_started_at": {"$lt": "probe"}}]
+    }),
+    ("unlock result", "quiz_results", {"id": "probe", "is_paid": {"$ne": True}}),
+    ("GET /checkout/status/{session_id}", "payment_transactions", {"session_id": "probe"}),
+    ("payment reconciliation", "payment_transactions", {
+        "payment_status": {"$in": ["pending", "unpaid"]},
+        "created_at": {"$gte": "probe", "$lte": "probe"}
+    }),
+    ("webhook dedupe", "webhook_events", {"event_id": "probe"}),
+    ("webhook recovery", "webhook_events", {"status": "pending"}),
+    ("email outbox claim", "email_outbox", {"status": "pending", "next_attempt_at": {"$lte": "probe"}}),
+]
+
+class QueryPlanRegression(AssertionError):
+    pass
+
+async def ensure_indexes(db) -> None:
+    for collection, indexes in INDEXES.items():
+        try:
+            names = await db[collection].create_indexes(indexes)
+        except OperationFailure as e:
+            # e.g. duplicate ids in old data blocking a unique index; the app
+            # still serves, verify_query_plans will report the missing index.
+            logger.error(f"Could not create indexes on {collection}: {e}")
+            continue
+        logger.info(f"Indexes on {collection}: {', '.join(names)}")
+
+def _plan_stages(plan) -> Iterator[str]:
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            yield plan["stage"]
+        for value in plan.values():
+            yield from _plan_stages(value)
+    elif isinstance(plan, list):
+        for value in plan:
+            yield from _plan_stages(value)
+
+async def verify_query_plans(db) -> Dict[str, List[str]]:
+    """Explain every route query and raise if any winning plan is a COLLSCAN."""
+    plans = {}
+    regressions = []
+    for route, collection, query in ROUTE_QUERIES:
+        explain = await db[collection].find(query).explain()
+        stages = list(_plan_stages(explain["queryPlanner"]["winningPlan"]))
+        plans[route] = stages
+        if "COLLSCAN" in stages:
+            regressions.append(f"{route} on {collection} {query}: {' -> '.join(stages)}")
+    if regressions:
+        raise QueryPlanRegression("Collection scans in query plans:\n" + "\n".join(regressions))
+    return plans
+
+async def main() -> None:
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    load_dotenv(Path(__file__).parent / '.env')
+    client = AsyncIOMotorClient(os.environ["MONGO_URL"])
+    db = client[os.environ["DB_NAME"]]
+    try:
+        await ensure_indexes(db)
+        if "--verify" in sys.argv:
+            for route, stages in (await verify_query_plans(db)).items():
+                print(f"{route}: {' -> '.join(stages)}")
+    finally:
+        client.close()
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main())
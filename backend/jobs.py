@@ -0,0 +1,23 @@
+from datetime import datetime, timedelta, timezone
+
+from pymongo.errors import DuplicateKeyError
+
+async def acquire_lease(db, job_id: str, seconds: float) -> bool:
+    """Take the ``jobs`` lease for ``job_id`` if it's free or expired.
+
+    Keeps periodic jobs from running in several app processes at once.
+    """
+    now = datetime.now(timezone.utc)
+    lease_until = (now + timedelta(seconds=seconds)).isoformat()
+    lease = await db.jobs.find_one_and_update(
+        {"_id": job_id, "lease_until": {"$lte": now.isoformat()}},
+        {"$set": {"lease_until": lease_until}}
+    )
+    if lease is not None:
+        return True
+    try:
+        await db.jobs.insert_one({"_id": job_id, "lease_until": lease_until})
+        return True
+    except DuplicateKeyError:
+        # Another process holds the lease (or just created it).
+        return False
@@ -0,0 +1,259 @@
+import bisect
+import threading
+import time
+from typing import Callable, Dict, List, Tuple
+
+from pymongo import monitoring
+
+# Minimal Prometheus-style metrics. Mongo command events arrive on driver
+# threads, so every update takes the metric's lock; the critical sections are
+# a few integer/float additions.
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._lock = threading.Lock()
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def value(self, *labels: str) -> float:
+        return self._values.get(labels, 0.0)
+
+    def render(self) -> List[str]:
+        lines = self.header()
+        for labels, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {value}")
+        return lines
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, *labels: str, amount: float = 1.0) -> None:
+        self.inc(*labels, amount=-amount)
+
+    def set(self, *labels: str, value: float) -> None:
+        with self._lock:
+            self._values[labels] = value
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+        # labels -> [per-bucket counts (+Inf last), sum, count]
+        self._series: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def time(self, *labels: str) -> "_Timer":
+        return _Timer(self, labels)
+
+    def count(self, *labels: str) -> int:
+        series = self._series.get(labels)
+        return series[2] if series else 0
+
+    def render(self) -> List[str]:
+        lines = self.header()
+        for labels, (counts, total, count) in sorted(self._series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                bucket_labels = _format_labels(self.labelnames, labels, f'le="{le}"')
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            label_str = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{label_str} {total}")
+            lines.append(f"{self.name}_count{label_str} {count}")
+        return lines
+
+class _Timer:
+    __slots__ = ("histogram", "labels", "start")
+
+    def __init__(self, histogram: Histogram, labels: Tuple[str, ...]):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, *self.labels)
+        return False
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+        self._collectors: List[Tuple[str, Callable[[], Dict[str, float]]]] = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, prefix: str, collect: Callable[[], Dict[str, float]]) -> None:
+        # For components that already keep their own counters (caches,
+        # queues): their stats() are exported as gauges at scrape time.
+        self._collectors.append((prefix, collect))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for prefix, collect in self._collectors:
+            for key, value in collect().items():
+                if isinstance(value, (int, float)):
+                    lines.append(f"# TYPE {prefix}_{key} gauge")
+                    lines.append(f"{prefix}_{key} {float(value)}")
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+
+HTTP_REQUEST_SECONDS = REGISTRY.register(Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route", ("method", "route", "status")))
+HTTP_IN_FLIGHT = REGISTRY.register(Gauge(
+    "http_requests_in_flight", "HTTP requests currently being served", ("method",)))
+MONGO_COMMAND_SECONDS = REGISTRY.register(Histogram(
+    "mongo_command_duration_seconds", "MongoDB command latency", ("command", "collection", "outcome")))
+PAYMENT_CALL_SECONDS = REGISTRY.register(Histogram(
+    "payment_call_duration_seconds", "Payment gateway call latency", ("operation", "outcome")))
+SINGLE_FLIGHT_CALLS = REGISTRY.register(Counter(
+    "single_flight_calls_total", "Coalesced lookups by role (leader, collapsed, timeout)", ("flight", "role")))
+PAYMENT_REJECTED = REGISTRY.register(Counter(
+    "payment_calls_rejected_total", "Payment calls refused without reaching the provider", ("operation", "reason")))
+PAYMENT_CIRCUIT_STATE = REGISTRY.register(Gauge(
+    "payment_circuit_state", "Payment circuit breaker state (0 closed, 1 half-open, 2 open)"))
+RATE_LIMITED = REGISTRY.register(Counter(
+    "rate_limited_requests_total", "Requests refused with 429 by a per-client rate limiter", ("limiter",)))
+ADMISSION_REJECTED = REGISTRY.register(Counter(
+    "admission_rejected_total", "Requests shed with 503 by admission control", ("reason",)))
+ADMISSION_IN_FLIGHT = REGISTRY.register(Gauge(
+    "admission_in_flight", "API requests admitted and running"))
+ADMISSION_QUEUED = REGISTRY.register(Gauge(
+    "admission_queued", "API requests waiting for admission"))
+ADMISSION_STREAMS = REGISTRY.register(Gauge(
+    "admission_streams", "Open event streams (limited separately from requests)"))
+SCORING_SECONDS = REGISTRY.register(Histogram(
+    "scoring_step_duration_seconds", "Scoring step latency", ("step",),
+    buckets=(0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.01, 0.1, 1.0)))
+
+class MetricsMiddleware:
+    """ASGI middleware recording per-route latency and in-flight requests.
+
+    Routes are labelled by their path template (``/api/results/{result_id}``)
+    so ids don't blow up label cardinality; unmatched paths share one label.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        status = ["500"]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = str(message["status"])
+            await send(message)
+
+        # The route is only known after routing, so in-flight requests are
+        # counted per method; latency is labelled by route when they finish.
+        HTTP_IN_FLIGHT.inc(method)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_IN_FLIGHT.dec(method)
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "unmatched"
+            HTTP_REQUEST_SECONDS.observe(time.perf_counter() - start, method, path, status[0])
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """pymongo command listener timing every Mongo call the app makes."""
+
+    def __init__(self):
+        self._collections: Dict[Tuple[str, int], str] = {}
+        self._lock = threading.Lock()
+
+    def started(self, event) -> None:
+        collection = event.command.get(event.command_name)
+        if not isinstance(collection, str):
+            collection = ""
+        with self._lock:
+            self._collections[(event.connection_id, event.request_id)] = collection
+
+    def _finish(self, event, outcome: str) -> None:
+        with self._lock:
+            collection = self._collections.pop((event.connection_id, event.request_id), "")
+        MONGO_COMMAND_SECONDS.observe(event.duration_micros / 1e6, event.command_name, collection, outcome)
+
+    def succeeded(self, event) -> None:
+        self._finish(event, "ok")
+
+    def failed(self, event) -> None:
+        self._finish(event, "error")
+
+def observe_payment_call(operation: str, outcome: str, seconds: float) -> None:
+    PAYMENT_CALL_SECONDS.observe(seconds, operation, outcome)
+
+def observe_payment_rejected(operation: str, reason: str) -> None:
+    PAYMENT_REJECTED.inc(operation, reason)
+
+def observe_single_flight(flight: str, role: str) -> None:
+    SINGLE_FLIGHT_CALLS.inc(flight, role)
+
+def observe_rate_limited(limiter: str) -> None:
+    RATE_LIMITED.inc(limiter)
+
+def observe_admission_rejected(reason: str) -> None:
+    ADMISSION_REJECTED.inc(reason)
+
+def set_admission_load(in_flight: int, queued: int) -> None:
+    ADMISSION_IN_FLIGHT.set(value=in_flight)
+    ADMISSION_QUEUED.set(value=queued)
+
+def set_admission_streams(streams: int) -> None:
+    ADMISSION_STREAMS.set(value=streams)
+
+CIRCUIT_STATE_VALUES = {"closed": 0, "half_open": 1, "open": 2}
+
+def set_payment_circuit_state(state: str) -> None:
+    PAYMENT_CIRCUIT_STATE.set(value=CIRCUIT_STATE_VALUES[state])
+
+def render_metrics() -> str:
+    return REGISTRY.render()
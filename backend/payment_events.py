@@ -0,0 +1,57 @@
+import asyncio
+from typing import Dict, Set
+
+class Subscription:
+    def __init__(self, broker: "PaymentEventBroker", result_id: str):
+        self.broker = broker
+        self.result_id = result_id
+        self.queue: asyncio.Queue = asyncio.Queue()
+
+    async def get(self) -> Dict:
+        return await self.queue.get()
+
+    def close(self) -> None:
+        self.broker.unsubscribe(self)
+
+class PaymentEventBroker:
+    """Fans payment events out to the waiters of a result id.
+
+    This implementation is in-process. A shared broker (e.g. Redis pub/sub)
+    can subclass it, forward ``publish`` to the shared channel and call
+    ``deliver`` for messages received from it, so every app process wakes
+    its own local waiters.
+    """
+
+    def __init__(self):
+        self._subscribers: Dict[str, Set[Subscription]] = {}
+        self.published = 0
+        self.delivered = 0
+
+    def subscribe(self, result_id: str) -> Subscription:
+        subscription = Subscription(self, result_id)
+        self._subscribers.setdefault(result_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        subscribers = self._subscribers.get(subscription.result_id)
+        if subscribers is None:
+            return
+        subscribers.discard(subscription)
+        if not subscribers:
+            del self._subscribers[subscription.result_id]
+
+    async def publish(self, result_id: str, event: Dict) -> None:
+        self.published += 1
+        self.deliver(result_id, event)
+
+    def deliver(self, result_id: str, event: Dict) -> None:
+        for subscription in self._subscribers.get(result_id, ()):
+            subscription.queue.put_nowait(event)
+            self.delivered += 1
+
+    def stats(self) -> Dict:
+        return {
+            "waiting": sum(len(s) for s in self._subscribers.values()),
+            "published": self.published,
+            "delivered": self.delivered,
+        }
@@ -0,0 +1,347 @@
+import asyncio
+import json
+import logging
+import time
+import uuid
+from typing import Dict, Optional
+
+from pydantic import BaseModel
+from metrics import observe_payment_call, observe_payment_rejected, set_payment_circuit_state
+from emergentintegrations.payments.stripe.checkout import (
+    StripeCheckout,
+    CheckoutSessionResponse,
+    CheckoutStatusResponse,
+    CheckoutSessionRequest
+)
+
+logger = logging.getLogger(__name__)
+
+class PaymentGatewayTimeout(Exception):
+    pass
+
+class PaymentGatewayUnavailable(Exception):
+    """Raised without calling the provider: circuit open or bulkhead full."""
+
+# Exception types (by class name, anywhere in the MRO) that mean the
+# provider couldn't be reached: stripe's APIConnectionError, httpx's
+# TransportError family.
+CONNECTION_ERROR_NAMES = {"APIConnectionError", "TransportError"}
+
+def is_provider_failure(error: BaseException) -> bool:
+    """Whether ``error`` says the provider is unhealthy, not the request bad.
+
+    Timeouts, connection errors and 5xx answers count; 4xx answers (an
+    unknown session id, a bad signature) and other errors don't.
+    """
+    if isinstance(error, (asyncio.TimeoutError, OSError)):
+        return True
+    if any(cls.__name__ in CONNECTION_ERROR_NAMES for cls in type(error).__mro__):
+        return True
+    status = getattr(error, "http_status", None) or getattr(error, "status_code", None)
+    if status is None and getattr(error, "response", None) is not None:
+        status = getattr(error.response, "status_code", None)
+    return isinstance(status, int) and status >= 500
+
+class CircuitBreaker:
+    """Opens after ``failure_threshold`` consecutive failures.
+
+    While open, calls fail fast for ``reset_timeout`` seconds; then a single
+    trial call is let through (half-open) and its outcome closes or re-opens
+    the circuit.
+    """
+
+    CLOSED = "closed"
+    HALF_OPEN = "half_open"
+    OPEN = "open"
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = 0.0
+        self.times_opened = 0
+        self._state = self.CLOSED
+        self._trial_in_flight = False
+        set_payment_circuit_state(self._state)
+
+    @property
+    def state(self) -> str:
+        if self._state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self._transition(self.HALF_OPEN)
+        return self._state
+
+    def _transition(self, state: str) -> None:
+        if state != self._state:
+            logger.warning(f"Payment circuit {self._state} -> {state}")
+            self._state = state
+            set_payment_circuit_state(state)
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == self.CLOSED:
+            return True
+        if state == self.HALF_OPEN and not self._trial_in_flight:
+            self._trial_in_flight = True
+            return True
+        return False
+
+    def release(self) -> None:
+        # The allowed call didn't tell us anything (bulkhead full, 4xx,
+        # cancelled): let the next one be the trial.
+        self._trial_in_flight = False
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self._trial_in_flight = False
+        self._transition(self.CLOSED)
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        self._trial_in_flight = False
+        if self._state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+            self.times_opened += 1
+            self._transition(self.OPEN)
+
+class PaymentGateway:
+    """Process-wide payment client shared by the checkout routes.
+
+    Every provider call goes through three guards:
+    - deadline: each call is bounded by ``timeout`` seconds, and a timed-out
+      call raises PaymentGatewayTimeout.
+    - bulkhead: at most ``max_concurrency`` calls are in flight. A call that
+      can't get a slot within ``queue_timeout`` seconds raises
+      PaymentGatewayUnavailable.
+    - circuit breaker: ``breaker`` fails calls fast with
+      PaymentGatewayUnavailable while the provider keeps failing.
+
+    Webhook parsing is deadline-bound only: it verifies a signature
+    locally, so neither a busy bulkhead nor an open circuit may turn a
+    delivered event away.
+    """
+
+    def __init__(
+        self,
+        timeout: float = 15.0,
+        max_concurrency: int = 20,
+        queue_timeout: float = 1.0,
+        breaker: Optional[CircuitBreaker] = None,
+    ):
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency
+        self.queue_timeout = queue_timeout
+        self.breaker = breaker or CircuitBreaker()
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self.in_flight = 0
+
+    async def _call(self, operation: str, coro, guarded: bool = True):
+        if not guarded:
+            return await self._call_unguarded(operation, coro)
+        if not self.breaker.allow():
+            coro.close()
+            observe_payment_rejected(operation, "circuit_open")
+            raise PaymentGatewayUnavailable("Payment provider unavailable (circuit open)")
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            coro.close()
+            self.breaker.release()
+            observe_payment_rejected(operation, "bulkhead_full")
+            raise PaymentGatewayUnavailable("Payment provider busy")
+
+        self.in_flight += 1
+        start = time.perf_counter()
+        # "cancelled" until something else is known: CancelledError (the
+        # client went away) isn't an Exception and says nothing about the
+        # provider.
+        outcome = "cancelled"
+        try:
+            result = await asyncio.wait_for(coro, timeout=self.timeout)
+            outcome = "ok"
+            return result
+        except asyncio.TimeoutError:
+            outcome = "timeout"
+            raise PaymentGatewayTimeout(f"Payment provider did not answer within {self.timeout}s")
+        except Exception as e:
+            outcome = "error" if is_provider_failure(e) else "rejected"
+            raise
+        finally:
+            self.in_flight -= 1
+            self._semaphore.release()
+            observe_payment_call(operation, outcome, time.perf_counter() - start)
+            if outcome == "ok":
+                self.breaker.record_success()
+            elif outcome in ("timeout", "error"):
+                self.breaker.record_failure()
+            else:
+                # A refused request or a cancelled caller says nothing
+                # either way about the provider's health.
+                self.breaker.release()
+
+    async def _call_unguarded(self, operation: str, coro):
+        start = time.perf_counter()
+        outcome = "cancelled"
+        try:
+            result = await asyncio.wait_for(coro, timeout=self.timeout)
+            outcome = "ok"
+            return result
+        except asyncio.TimeoutError:
+            outcome = "timeout"
+            raise PaymentGatewayTimeout(f"Payment provider did not answer within {self.timeout}s")
+        except Exception:
+            outcome = "rejected"
+            raise
+        finally:
+            observe_payment_call(operation, outcome, time.perf_counter() - start)
+
+    def stats(self) -> Dict:
+        return {
+            "in_flight": self.in_flight,
+            "max_concurrency": self.max_concurrency,
+            "circuit_state": self.breaker.state,
+            "circuit_failures": self.breaker.failures,
+            "circuit_opened": self.breaker.times_opened,
+        }
+
+    def bind_webhook_url(self, base_url: str) -> None:
+        pass
+
+    async def create_checkout_session(self, request: CheckoutSessionRequest) -> CheckoutSessionResponse:
+        raise NotImplementedError
+
+    async def get_checkout_status(self, session_id: str) -> CheckoutStatusResponse:
+        raise NotImplementedError
+
+    async def handle_webhook(self, body: bytes, signature: Optional[str]):
+        raise NotImplementedError
+
+    async def close(self) -> None:
+        pass
+
+class StripePaymentGateway(PaymentGateway):
+    def __init__(self, api_key: str, webhook_url: Optional[str] = None, timeout: float = 15.0, **options):
+        super().__init__(timeout=timeout, **options)
+        self.api_key = api_key
+        self.webhook_url = webhook_url
+        self._checkout: Optional[StripeCheckout] = None
+        self._http_client = _install_pooled_stripe_transport(timeout)
+
+    def bind_webhook_url(self, base_url: str) -> None:
+        # Without a configured URL the webhook endpoint is derived from the
+        # first request's base URL, as the routes used to do on every call.
+        if self.webhook_url is None:
+            self.webhook_url = f"{base_url.rstrip('/')}/api/webhook/stripe"
+
+    @property
+    def checkout(self) -> StripeCheckout:
+        if self._checkout is None:
+            self._checkout = StripeCheckout(api_key=self.api_key, webhook_url=self.webhook_url)
+        return self._checkout
+
+    async def create_checkout_session(self, request: CheckoutSessionRequest) -> CheckoutSessionResponse:
+        return await self._call("create_checkout_session", self.checkout.create_checkout_session(request))
+
+    async def get_checkout_status(self, session_id: str) -> CheckoutStatusResponse:
+        return await self._call("get_checkout_status", self.checkout.get_checkout_status(session_id))
+
+    async def handle_webhook(self, body: bytes, signature: Optional[str]):
+        return await self._call("handle_webhook", self.checkout.handle_webhook(body, signature), guarded=False)
+
+    async def close(self) -> None:
+        if self._http_client is not None:
+            await self._http_client.close_async()
+
+def _install_pooled_stripe_transport(timeout: float):
+    # StripeCheckout talks to Stripe through the stripe SDK's global HTTP
+    # client; installing one shared client keeps connections alive across
+    # requests instead of paying a TLS handshake per call.
+    try:
+        import stripe
+        import requests
+        http_client = stripe.RequestsClient(
+            timeout=timeout,
+            session=requests.Session(),
+            async_fallback_client=stripe.HTTPXClient(timeout=timeout),
+        )
+    except (ImportError, AttributeError, TypeError) as e:
+        logger.warning(f"Using the default Stripe HTTP client: {e}")
+        return None
+    stripe.default_http_client = http_client
+    return http_client
+
+class FakeWebhookEvent(BaseModel):
+    event_type: str
+    event_id: str
+    session_id: str
+    payment_status: str
+    metadata: Dict[str, str] = {}
+
+class FakePaymentGateway(PaymentGateway):
+    """Local stand-in for tests and load runs; never touches the network.
+
+    Sessions start ``unpaid``; ``mark_paid`` flips them. Webhook bodies are
+    JSON objects with the FakeWebhookEvent fields and are not signed.
+    """
+
+    def __init__(self, latency: float = 0.0, **options):
+        super().__init__(**options)
+        self.latency = latency
+        self.sessions: Dict[str, Dict] = {}
+
+    async def _respond(self, value):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return value
+
+    def mark_paid(self, session_id: str) -> None:
+        self.sessions[session_id]["payment_status"] = "paid"
+        self.sessions[session_id]["status"] = "complete"
+
+    async def create_checkout_session(self, request: CheckoutSessionRequest) -> CheckoutSessionResponse:
+        session_id = f"cs_fake_{uuid.uuid4().hex}"
+        self.sessions[session_id] = {
+            "status": "open",
+            "payment_status": "unpaid",
+            "amount_total": int(round(request.amount * 100)),
+            "currency": request.currency,
+            "metadata": dict(request.metadata or {}),
+        }
+        response = CheckoutSessionResponse(url=f"https://checkout.local/{session_id}", session_id=session_id)
+        return await self._call("create_checkout_session", self._respond(response))
+
+    async def get_checkout_status(self, session_id: str) -> CheckoutStatusResponse:
+        session = self.sessions.get(session_id, {
+            "status": "expired",
+            "payment_status": "unpaid",
+            "amount_total": 0,
+            "currency": "usd",
+            "metadata": {},
+        })
+        return await self._call("get_checkout_status", self._respond(CheckoutStatusResponse(**session)))
+
+    async def handle_webhook(self, body: bytes, signature: Optional[str]):
+        return await self._call("handle_webhook", self._respond(FakeWebhookEvent(**json.loads(body))), guarded=False)
+
+def create_payment_gateway(settings: Dict[str, str]) -> Optional[PaymentGateway]:
+    timeout = float(settings.get("PAYMENT_TIMEOUT_SECONDS", "15"))
+    options = {
+        "max_concurrency": int(settings.get("PAYMENT_MAX_CONCURRENCY", "20")),
+        "queue_timeout": float(settings.get("PAYMENT_QUEUE_TIMEOUT_SECONDS", "1")),
+        "breaker": CircuitBreaker(
+            failure_threshold=int(settings.get("PAYMENT_BREAKER_FAILURES", "5")),
+            reset_timeout=float(settings.get("PAYMENT_BREAKER_RESET_SECONDS", "30")),
+        ),
+    }
+
+    if settings.get("PAYMENT_GATEWAY") == "fake":
+        return FakePaymentGateway(timeout=timeout, **options)
+
+    api_key = settings.get("STRIPE_API_KEY")
+    if not api_key:
+        return None
+    return StripePaymentGateway(
+        api_key=api_key,
+        webhook_url=settings.get("STRIPE_WEBHOOK_URL"),
+        timeout=timeout,
+        **options,
+    )
@@ -0,0 +1,133 @@
+import gzip
+import hashlib
+import json
+from typing import Dict, Iterable, List, Optional
+
+from starlette.requests import Request
+from starlette.responses import Response
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Static JSON payloads are serialized and compressed once; serving them is a
+# header comparison and a bytes copy. Every encoding gets its own strong
+# ETag, as the representations differ byte for byte.
+
+def _parse_qvalues(header: Optional[str]) -> List[tuple]:
+    """``a;q=0.5, b`` -> [("b", 1.0), ("a", 0.5)], highest preference first."""
+    values = []
+    for position, part in enumerate((header or "").split(",")):
+        token, _, params = part.strip().partition(";")
+        if not token:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        values.append((token.strip().lower(), q, position))
+    values.sort(key=lambda value: (-value[1], value[2]))
+    return [(token, q) for token, q, _ in values]
+
+def negotiate_encoding(accept_encoding: Optional[str], available: Iterable[str]) -> str:
+    accepted = {token: q for token, q in _parse_qvalues(accept_encoding)}
+    # Smallest first; identity is always acceptable unless explicitly refused.
+    for encoding in ("br", "gzip"):
+        if encoding in available and accepted.get(encoding, accepted.get("*", 0.0)) > 0:
+            return encoding
+    return "identity"
+
+def negotiate_locale(accept_language: Optional[str], available: Iterable[str], default: str) -> str:
+    available = list(available)
+    for token, q in _parse_qvalues(accept_language):
+        if q <= 0:
+            continue
+        if token in available:
+            return token
+        primary = token.split("-")[0]
+        if primary in available:
+            return primary
+    return default
+
+def etag_matches(if_none_match: Optional[str], etags: Iterable[str]) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # If-None-Match uses the weak comparison: W/"x" matches "x".
+    candidates = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return any(etag in candidates for etag in etags)
+
+class PrecompiledPayload:
+    def __init__(self, content, media_type: str = "application/json", cache_control: str = "public, max-age=300"):
+        body = json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+        self.media_type = media_type
+        self.cache_control = cache_control
+        self.bodies: Dict[str, bytes] = {"identity": body}
+        compressed = {"gzip": gzip.compress(body, compresslevel=9, mtime=0)}
+        if brotli is not None:
+            compressed["br"] = brotli.compress(body, quality=11)
+        for encoding, data in compressed.items():
+            if len(data) < len(body):
+                self.bodies[encoding] = data
+        digest = hashlib.sha256(body).hexdigest()[:32]
+        self.etags = {
+            encoding: f'"{digest}"' if encoding == "identity" else f'"{digest}-{encoding}"'
+            for encoding in self.bodies
+        }
+
+    def respond(self, request: Request, headers: Optional[Dict[str, str]] = None) -> Response:
+        encoding = negotiate_encoding(request.headers.get("accept-encoding"), self.bodies)
+        response_headers = {
+            "ETag": self.etags[encoding],
+            "Cache-Control": self.cache_control,
+            "Vary": "Accept-Encoding",
+            **(headers or {}),
+        }
+        if etag_matches(request.headers.get("if-none-match"), self.etags.values()):
+            return Response(status_code=304, headers=response_headers)
+        if encoding != "identity":
+            response_headers["Content-Encoding"] = encoding
+        return Response(self.bodies[encoding], media_type=self.media_type, headers=response_headers)
+
+class LocalizedPayloads:
+    """One PrecompiledPayload per locale, chosen by ``?locale=`` or Accept-Language."""
+
+    def __init__(self, payloads: Dict[str, PrecompiledPayload], default_locale: str):
+        self.payloads = payloads
+        self.default_locale = default_locale
+
+    def respond(self, request: Request, locale: Optional[str] = None) -> Response:
+        if locale not in self.payloads:
+            locale = negotiate_locale(request.headers.get("accept-language"), self.payloads, self.default_locale)
+        headers = {"Content-Language": locale}
+        if len(self.payloads) > 1:
+            headers["Vary"] = "Accept-Encoding, Accept-Language"
+        return self.payloads[locale].respond(request, headers)
+
+def localized_questions(questions: List[Dict], translations: Dict[str, Dict[str, str]]) -> Dict[str, List[Dict]]:
+    """Question lists per locale from a spec's ``locales`` table.
+
+    ``translations`` maps a locale to question number -> text; untranslated
+    questions keep the default text.
+    """
+    return {
+        locale: [{**q, "text": texts.get(str(q["n"]), q["text"])} for q in questions]
+        for locale, texts in translations.items()
+    }
+
+def question_payloads(engine, cache_control: str) -> LocalizedPayloads:
+    default_locale = engine.spec.get("default_locale", "en")
+    variants = {default_locale: engine.questions}
+    variants.update(localized_questions(engine.questions, engine.spec.get("locales", {})))
+    return LocalizedPayloads(
+        {
+            locale: PrecompiledPayload({"questions": questions}, cache_control=cache_control)
+            for locale, questions in variants.items()
+        },
+        default_locale
+    )
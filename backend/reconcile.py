@@ -0,0 +1,182 @@
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from dotenv import load_dotenv
+from pymongo import UpdateOne
+
+from jobs import acquire_lease
+from webhooks import notify_unlocked, unlock_results
+
+logger = logging.getLogger(__name__)
+
+PENDING_PAYMENT_STATUSES = ["pending", "unpaid"]
+
+class PaymentReconciler:
+    """Asks the payment provider about transactions nobody came back for.
+
+    If the browser never polls /checkout/status and the webhook is lost, a
+    transaction stays pending and its result locked. Each run walks pending
+    transactions older than ``min_age`` (and younger than ``max_age``, past
+    which checkout sessions have expired anyway) in (created_at, session_id)
+    order, ``batch_size`` at a time. It checks their status with at most
+    ``concurrency`` calls in flight, then writes transaction updates with one
+    bulk_write and unlocks paid results with conditional updates.
+
+    ``start`` runs it every ``interval`` seconds; a lease in ``jobs`` keeps
+    concurrent app processes from reconciling at the same time.
+    """
+
+    JOB_ID = "payment_reconcile"
+
+    def __init__(
+        self,
+        db,
+        get_gateway: Callable[[], Optional[object]],
+        on_unlock: Callable[[str], Awaitable[None]],
+        batch_size: int = 200,
+        concurrency: int = 10,
+        min_age: timedelta = timedelta(minutes=5),
+        max_age: timedelta = timedelta(hours=48),
+        interval: float = 300.0,
+        on_paid: Optional[Callable[[str], Awaitable[None]]] = None,
+    ):
+        self.db = db
+        self.get_gateway = get_gateway
+        self.on_unlock = on_unlock
+        self.on_paid = on_paid
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.min_age = min_age
+        self.max_age = max_age
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+        self.last_report: Dict = {}
+
+    async def start(self) -> None:
+        if self.interval > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                if await acquire_lease(self.db, self.JOB_ID, self.interval * 0.9):
+                    self.last_report = await self.run_once()
+                    if self.last_report["unlocked"]:
+                        logger.info(f"Reconciliation unlocked {self.last_report['unlocked']} results")
+            except Exception as e:
+                logger.error(f"Payment reconciliation failed: {e}")
+
+    async def _check(self, gateway, semaphore: asyncio.Semaphore, transaction: Dict):
+        async with semaphore:
+            try:
+                return transaction, await gateway.get_checkout_status(transaction["session_id"])
+            except Exception as e:
+                logger.warning(f"Status check for {transaction['session_id']} failed: {e}")
+                return transaction, None
+
+    async def run_once(self) -> Dict:
+        report = {"scanned": 0, "checked": 0, "errors": 0, "paid": 0, "expired": 0, "unlocked": 0}
+        gateway = self.get_gateway()
+        if gateway is None:
+            return report
+
+        now = datetime.now(timezone.utc)
+        query = {
+            "payment_status": {"$in": PENDING_PAYMENT_STATUSES},
+            "created_at": {"$gte": (now - self.max_age).isoformat(), "$lte": (now - self.min_age).isoformat()},
+            "status": {"$ne": "expired"},
+        }
+        semaphore = asyncio.Semaphore(self.concurrency)
+        last: Optional[Dict] = None
+
+        while True:
+            batch_query = query
+            if last is not None:
+                # Keyset pagination on the index order, stable under updates.
+                batch_query = {**query, "$or": [
+                    {"created_at": {"$gt": last["created_at"]}},
+                    {"created_at": last["created_at"], "session_id": {"$gt": last["session_id"]}},
+                ]}
+            batch = await self.db.payment_transactions.find(
+                batch_query,
+                {"_id": 0, "session_id": 1, "result_id": 1, "created_at": 1}
+            ).sort([("created_at", 1), ("session_id", 1)]).limit(self.batch_size).to_list(self.batch_size)
+            if not batch:
+                break
+            last = batch[-1]
+            report["scanned"] += len(batch)
+            await self._apply(
+                await asyncio.gather(*(self._check(gateway, semaphore, t) for t in batch)),
+                report
+            )
+        return report
+
+    async def _apply(self, results: List, report: Dict) -> None:
+        now = datetime.now(timezone.utc).isoformat()
+        ops = []
+        paid_result_ids = []
+        for transaction, status in results:
+            if status is None:
+                report["errors"] += 1
+                continue
+            report["checked"] += 1
+            ops.append(UpdateOne(
+                {"session_id": transaction["session_id"]},
+                {"$set": {
+                    "payment_status": status.payment_status,
+                    "status": status.status,
+                    "updated_at": now,
+                    "reconciled_at": now
+                }}
+            ))
+            if status.payment_status == "paid":
+                report["paid"] += 1
+                if transaction.get("result_id"):
+                    paid_result_ids.append(transaction["result_id"])
+            elif status.status == "expired":
+                report["expired"] += 1
+        if ops:
+            await self.db.payment_transactions.bulk_write(ops, ordered=False)
+        paid_result_ids = list(dict.fromkeys(paid_result_ids))
+        unlocked = await unlock_results(self.db, paid_result_ids, now)
+        report["unlocked"] += len(unlocked)
+        await notify_unlocked(self.on_unlock, unlocked)
+        if self.on_paid is not None:
+            await notify_unlocked(self.on_paid, [result_id for result_id in paid_result_ids if result_id not in unlocked])
+
+async def main() -> None:
+    from motor.motor_asyncio import AsyncIOMotorClient
+    from payments import create_payment_gateway
+
+    load_dotenv(Path(__file__).parent / '.env')
+    client = AsyncIOMotorClient(os.environ["MONGO_URL"])
+    db = client[os.environ["DB_NAME"]]
+    gateway = create_payment_gateway(os.environ)
+    if gateway is None:
+        raise SystemExit("Payment gateway not configured")
+
+    async def report_unlock(result_id: str):
+        print(f"unlocked {result_id}")
+
+    try:
+        report = await PaymentReconciler(db, lambda: gateway, report_unlock).run_once()
+        for key, value in report.items():
+            print(f"{key}: {value}")
+    finally:
+        await gateway.close()
+        client.close()
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main())
@@ -0,0 +1,178 @@
+import argparse
+import asyncio
+import logging
+import os
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from dotenv import load_dotenv
+from pymongo import UpdateOne
+
+from result_format import compact_fields, expand_result, stored_answers
+from scoring import ScoringRegistry, default_registry
+
+def _plain(value):
+    if isinstance(value, tuple):
+        return list(value)
+    return value
+
+def diff_payloads(old: Dict, new: Dict) -> Dict[str, List]:
+    changes = {}
+    for key in sorted(set(old) | set(new)):
+        if key == "scores":
+            for score_key in sorted(set(old.get("scores", {})) | set(new.get("scores", {}))):
+                before = old.get("scores", {}).get(score_key)
+                after = new.get("scores", {}).get(score_key)
+                if before != after:
+                    changes[f"scores.{score_key}"] = [before, after]
+        elif _plain(old.get(key)) != _plain(new.get(key)):
+            changes[key] = [_plain(old.get(key)), _plain(new.get(key))]
+    return changes
+
+async def rescore_results(
+    db,
+    registry: ScoringRegistry,
+    target_version: Optional[int] = None,
+    batch_size: int = 500,
+    max_docs_per_second: Optional[float] = None,
+    dry_run: bool = False,
+    job_id: str = "rescore",
+    restart: bool = False,
+    max_diffs: int = 20,
+) -> Dict:
+    """Re-score stored quiz_results with the target (default current) spec.
+
+    Documents are read in ``_id`` order in batches of ``batch_size`` and the
+    changed ones are rewritten in the compact format with one unordered
+    ``bulk_write`` per batch. After every batch the last ``_id`` is
+    checkpointed in ``jobs`` under ``job_id``, so an interrupted run resumes
+    where it stopped unless ``restart`` is set. ``max_docs_per_second``
+    throttles the scan. With ``dry_run`` nothing is written or checkpointed
+    and the report lists sample diffs and label transitions instead.
+    """
+    target = registry.get(target_version) if target_version is not None else registry.current
+    checkpoint = None if dry_run or restart else await db.jobs.find_one({"_id": job_id})
+    # A finished job starts over; an interrupted one picks up after last_id.
+    last_id = checkpoint["last_id"] if checkpoint and "finished_at" not in checkpoint else None
+
+    report = {
+        "target_version": target.version,
+        "dry_run": dry_run,
+        "resumed_from": last_id,
+        "scanned": 0,
+        "changed": 0,
+        "written": 0,
+        "skipped": 0,
+        "label_changes": Counter(),
+        "diffs": [],
+    }
+    started = time.monotonic()
+
+    while True:
+        query = {"_id": {"$gt": last_id}} if last_id is not None else {}
+        batch = await db.quiz_results.find(query).sort("_id", 1).limit(batch_size).to_list(batch_size)
+        if not batch:
+            break
+
+        ops = []
+        for doc in batch:
+            report["scanned"] += 1
+            answers = stored_answers(doc, registry)
+            if not answers or len(answers) != target.question_count:
+                report["skipped"] += 1
+                continue
+            sums = target.compute_sums(answers)
+            if doc.get("scoring_version") == target.version and doc.get("sums") == sums:
+                continue
+
+            old = expand_result(doc, registry).full
+            new = target.lookup(sums).full
+            changes = diff_payloads(old, new)
+            if changes:
+                report["changed"] += 1
+                if "label" in changes:
+                    report["label_changes"][" -> ".join(changes["label"])] += 1
+                if len(report["diffs"]) < max_diffs:
+                    report["diffs"].append({"id": doc.get("id"), "changes": changes})
+
+            ops.append(UpdateOne(
+                {"_id": doc["_id"]},
+                {
+                    "$set": compact_fields(answers, sums, target.version),
+                    "$unset": {"answers": "", "teaser_results": "", "full_results": ""}
+                }
+            ))
+
+        last_id = batch[-1]["_id"]
+        if not dry_run:
+            if ops:
+                await db.quiz_results.bulk_write(ops, ordered=False)
+                report["written"] += len(ops)
+            await db.jobs.update_one(
+                {"_id": job_id},
+                {
+                    "$set": {
+                        "last_id": last_id,
+                        "target_version": target.version,
+                        "updated_at": datetime.now(timezone.utc).isoformat()
+                    },
+                    "$unset": {"finished_at": ""}
+                },
+                upsert=True
+            )
+
+        if max_docs_per_second:
+            ahead = report["scanned"] / max_docs_per_second - (time.monotonic() - started)
+            if ahead > 0:
+                await asyncio.sleep(ahead)
+
+    if not dry_run:
+        await db.jobs.update_one(
+            {"_id": job_id},
+            {"$set": {"finished_at": datetime.now(timezone.utc).isoformat()}}
+        )
+    report["label_changes"] = dict(report["label_changes"])
+    return report
+
+async def main() -> None:
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    parser = argparse.ArgumentParser(description="Re-score stored quiz results with the current scoring spec")
+    parser.add_argument("--version", type=int, help="target scoring version (default: current)")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--rate", type=float, help="max documents per second")
+    parser.add_argument("--dry-run", action="store_true", help="report diffs without writing")
+    parser.add_argument("--restart", action="store_true", help="ignore the saved checkpoint")
+    parser.add_argument("--job-id", default="rescore")
+    args = parser.parse_args()
+
+    load_dotenv(Path(__file__).parent / '.env')
+    client = AsyncIOMotorClient(os.environ["MONGO_URL"])
+    db = client[os.environ["DB_NAME"]]
+    try:
+        report = await rescore_results(
+            db,
+            default_registry(),
+            target_version=args.version,
+            batch_size=args.batch_size,
+            max_docs_per_second=args.rate,
+            dry_run=args.dry_run,
+            job_id=args.job_id,
+            restart=args.restart,
+        )
+    finally:
+        client.close()
+
+    for key in ("target_version", "dry_run", "resumed_from", "scanned", "changed", "written", "skipped"):
+        print(f"{key}: {report[key]}")
+    for transition, count in report["label_changes"].items():
+        print(f"  {transition}: {count}")
+    for diff in report["diffs"]:
+        print(f"  {diff['id']}: {diff['changes']}")
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main())
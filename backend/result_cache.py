@@ -0,0 +1,90 @@
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+class ResultCache:
+    """In-process LRU cache with per-entry TTL for quiz result documents.
+
+    Each process has its own; callers invalidate wherever they see a result
+    change (including a payment another process applied), and the TTL bounds
+    what they can't see.
+    """
+
+    def __init__(self, max_entries: int = 10000, ttl_seconds: float = 30.0):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, Tuple[float, Dict]]" = OrderedDict()
+        # key -> [loads in flight, generation]; invalidate bumps the
+        # generation so a load that started before it isn't cached.
+        self._loads: Dict[str, List[int]] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.stale_loads = 0
+
+    def get(self, key: str) -> Optional[Dict]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            self.evictions += 1
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: Dict) -> None:
+        self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    async def get_or_load(self, key: str, loader: Callable[[], Awaitable[Optional[Dict]]]) -> Optional[Dict]:
+        value = self.get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+
+        load = self._loads.setdefault(key, [0, 0])
+        load[0] += 1
+        generation = load[1]
+        try:
+            self.misses += 1
+            value = await loader()
+            # Misses are not cached: an unknown id stays a database lookup.
+            if value is not None:
+                if load[1] != generation:
+                    # Invalidated while loading; the value may predate the change.
+                    self.stale_loads += 1
+                    return value
+                self.set(key, value)
+            return value
+        finally:
+            load[0] -= 1
+            if load[0] == 0 and self._loads.get(key) is load:
+                del self._loads[key]
+
+    async def invalidate(self, key: str) -> None:
+        load = self._loads.get(key)
+        if load is not None:
+            load[1] += 1
+        if self._entries.pop(key, None) is not None:
+            self.invalidations += 1
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def stats(self) -> Dict:
+        return {
+            "size": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "stale_loads": self.stale_loads,
+        }
@@ -0,0 +1,104 @@
+import asyncio
+import logging
+import os
+import sys
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from dotenv import load_dotenv
+from pymongo import UpdateOne
+
+from scoring import ScoredResult, ScoringRegistry, default_registry
+
+logger = logging.getLogger(__name__)
+
+# Compact quiz_results documents keep the answers packed at 3 bits each (25
+# answers -> 10 bytes), the four section sums and the scoring version. The
+# teaser/full payloads are rebuilt from the scoring engine's shared tables on
+# read instead of being copied into every document.
+ANSWER_BITS = 3
+ANSWER_MASK = (1 << ANSWER_BITS) - 1
+
+# Documents written before scoring specs were versioned were scored by v1.
+LEGACY_SCORING_VERSION = 1
+
+def pack_answers(answers: List[int]) -> bytes:
+    packed = 0
+    for i, answer in enumerate(answers):
+        packed |= answer << (i * ANSWER_BITS)
+    return packed.to_bytes((len(answers) * ANSWER_BITS + 7) // 8, "little")
+
+def unpack_answers(data: bytes, count: int) -> List[int]:
+    packed = int.from_bytes(data, "little")
+    return [(packed >> (i * ANSWER_BITS)) & ANSWER_MASK for i in range(count)]
+
+def compact_fields(answers: List[int], sums: Dict[str, int], scoring_version: int) -> Dict:
+    return {
+        "answers_packed": pack_answers(answers),
+        "sums": dict(sums),
+        "scoring_version": scoring_version,
+    }
+
+def expand_result(doc: Dict, registry: ScoringRegistry) -> ScoredResult:
+    # Documents written before the compact format carry their payloads.
+    if "teaser_results" in doc:
+        return ScoredResult(teaser=doc["teaser_results"], full=doc["full_results"])
+    return registry.get(doc["scoring_version"]).lookup(doc["sums"])
+
+def stored_answers(doc: Dict, registry: ScoringRegistry) -> Optional[List[int]]:
+    if "answers_packed" in doc:
+        count = registry.get(doc["scoring_version"]).question_count
+        return unpack_answers(doc["answers_packed"], count)
+    return doc.get("answers")
+
+async def migrate_to_compact(db, registry: ScoringRegistry, batch_size: int = 1000) -> int:
+    """Convert legacy documents (raw answers + stored payloads) in place.
+
+    Only unconverted documents match the query, so the job can be re-run
+    until it reports zero.
+    """
+    engine = registry.get(LEGACY_SCORING_VERSION)
+    migrated = 0
+    cursor = db.quiz_results.find(
+        {"teaser_results": {"$exists": True}},
+        {"_id": 1, "answers": 1}
+    ).batch_size(batch_size)
+
+    ops = []
+    async for doc in cursor:
+        answers = doc.get("answers")
+        if not answers or len(answers) != engine.question_count:
+            logger.warning(f"Skipping quiz_results {doc['_id']}: no usable answers")
+            continue
+        ops.append(UpdateOne(
+            {"_id": doc["_id"]},
+            {
+                "$set": compact_fields(answers, engine.compute_sums(answers), engine.version),
+                "$unset": {"answers": "", "teaser_results": "", "full_results": ""}
+            }
+        ))
+        if len(ops) >= batch_size:
+            await db.quiz_results.bulk_write(ops, ordered=False)
+            migrated += len(ops)
+            ops = []
+    if ops:
+        await db.quiz_results.bulk_write(ops, ordered=False)
+        migrated += len(ops)
+    return migrated
+
+async def main() -> None:
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    load_dotenv(Path(__file__).parent / '.env')
+    client = AsyncIOMotorClient(os.environ["MONGO_URL"])
+    db = client[os.environ["DB_NAME"]]
+    batch_size = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    try:
+        migrated = await migrate_to_compact(db, default_registry(), batch_size=batch_size)
+        print(f"Migrated {migrated} quiz_results documents")
+    finally:
+        client.close()
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main())
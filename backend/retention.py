@@ -0,0 +1,245 @@
+import argparse
+import asyncio
+import gzip
+import logging
+import os
+import time
+import zlib
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from bson import json_util
+from dotenv import load_dotenv
+from pymongo import ASCENDING, IndexModel, ReplaceOne
+from pymongo.errors import DuplicateKeyError
+
+from jobs import acquire_lease
+
+logger = logging.getLogger(__name__)
+
+# Unpaid quiz_results older than the retention window move out of the hot
+# collection into quiz_results_archive, keyed by result id. An archive entry
+# either holds the zlib-compressed document inline or points at a gzip
+# member in a local NDJSON segment file. Each document is its own member,
+# so a segment is a regular .ndjson.gz and one document can be read back by
+# offset. Paid results are never archived.
+SEGMENT_PREFIX = "quiz_results-"
+
+def _encode(doc: Dict) -> bytes:
+    # Extended JSON, so binary fields (answers_packed) survive the round trip.
+    return json_util.dumps(doc, json_options=json_util.RELAXED_JSON_OPTIONS).encode("utf-8")
+
+def _decode(data: bytes) -> Dict:
+    return json_util.loads(data)
+
+class ResultArchive:
+    """Cold storage for archived results; slower to read than quiz_results."""
+
+    def __init__(self, db, segment_dir: Optional[str] = None, ttl_days: int = 0):
+        self.collection = db.quiz_results_archive
+        self.segment_dir = Path(segment_dir) if segment_dir else None
+        self.ttl_days = ttl_days
+        self.reads = 0
+        self.restored = 0
+
+    async def ensure_indexes(self) -> None:
+        if self.ttl_days > 0:
+            # Changing the window later needs a collMod on the existing index.
+            await self.collection.create_indexes([
+                IndexModel([("archived_at", ASCENDING)], expireAfterSeconds=self.ttl_days * 86400, name="archived_at_ttl")
+            ])
+
+    def _append_segment(self, docs: List[Dict]) -> List[Dict]:
+        self.segment_dir.mkdir(parents=True, exist_ok=True)
+        name = f"{SEGMENT_PREFIX}{datetime.now(timezone.utc).strftime('%Y%m%d')}.ndjson.gz"
+        locations = []
+        with open(self.segment_dir / name, "ab") as segment:
+            for doc in docs:
+                member = gzip.compress(_encode(doc) + b"\n")
+                locations.append({"segment": name, "offset": segment.tell(), "length": len(member)})
+                segment.write(member)
+            segment.flush()
+            os.fsync(segment.fileno())
+        return locations
+
+    async def put(self, docs: List[Dict]) -> None:
+        archived_at = datetime.now(timezone.utc)
+        if self.segment_dir is not None:
+            payloads = await asyncio.to_thread(self._append_segment, docs)
+        else:
+            payloads = [{"data": zlib.compress(_encode(doc), 6)} for doc in docs]
+        # Replace rather than insert, so re-archiving after a crash is harmless.
+        await self.collection.bulk_write(
+            [
+                ReplaceOne(
+                    {"_id": doc["id"]},
+                    {"created_at": doc.get("created_at"), "archived_at": archived_at, **payload},
+                    upsert=True
+                )
+                for doc, payload in zip(docs, payloads)
+            ],
+            ordered=False
+        )
+
+    def _read_segment(self, entry: Dict) -> bytes:
+        with open(self.segment_dir / entry["segment"], "rb") as segment:
+            segment.seek(entry["offset"])
+            return gzip.decompress(segment.read(entry["length"]))
+
+    async def get(self, result_id: str) -> Optional[Dict]:
+        entry = await self.collection.find_one({"_id": result_id})
+        if entry is None:
+            return None
+        self.reads += 1
+        if "data" in entry:
+            return _decode(zlib.decompress(entry["data"]))
+        if self.segment_dir is None:
+            logger.error(f"Archived result {result_id} is in segment {entry['segment']} but no segment directory is set")
+            return None
+        try:
+            return _decode(await asyncio.to_thread(self._read_segment, entry))
+        except OSError as e:
+            logger.error(f"Archived result {result_id} unreadable from {entry['segment']}: {e}")
+            return None
+
+    async def restore(self, db, result_id: str, **fields) -> Optional[Dict]:
+        """Move an archived result back into quiz_results (e.g. to pay for it).
+
+        ``fields`` are set on the restored document.
+        """
+        doc = await self.get(result_id)
+        if doc is None:
+            return None
+        doc.update(fields)
+        try:
+            await db.quiz_results.insert_one(dict(doc))
+        except DuplicateKeyError:
+            pass
+        await self.collection.delete_one({"_id": result_id})
+        self.restored += 1
+        return doc
+
+    def prune_segments(self) -> int:
+        """Delete segment files whose entries the TTL index has expired."""
+        if self.segment_dir is None or self.ttl_days <= 0 or not self.segment_dir.exists():
+            return 0
+        # A segment collects one UTC day of archiving; keep it a day past the TTL.
+        cutoff = time.time() - (self.ttl_days + 1) * 86400
+        removed = 0
+        for path in self.segment_dir.glob(f"{SEGMENT_PREFIX}*.ndjson.gz"):
+            if path.stat().st_mtime < cutoff:
+                path.unlink()
+                removed += 1
+        return removed
+
+    def stats(self) -> Dict:
+        return {"reads": self.reads, "restored": self.restored}
+
+async def archive_unpaid_results(db, archive: ResultArchive, older_than: timedelta, batch_size: int = 500) -> int:
+    """Move unpaid results created before now - ``older_than`` to the archive.
+
+    Each batch is copied to the archive before it's deleted from
+    quiz_results, and the delete re-checks ``is_paid``: a result paid in
+    between stays hot (its archive copy is never read). Results whose
+    checkout started within the window are left alone, so a payment never
+    lands on an archived result.
+    """
+    cutoff = (datetime.now(timezone.utc) - older_than).isoformat()
+    query = {
+        "is_paid": {"$ne": True},
+        "created_at": {"$lt": cutoff},
+        "$or": [{"checkout_started_at": {"$exists": False}}, {"checkout_started_at": {"$lt": cutoff}}],
+    }
+    archived = 0
+    while True:
+        batch = await db.quiz_results.find(query, {"_id": 0}).sort("created_at", 1).limit(batch_size).to_list(batch_size)
+        if not batch:
+            break
+        await archive.put(batch)
+        result = await db.quiz_results.delete_many({**query, "id": {"$in": [doc["id"] for doc in batch]}})
+        archived += result.deleted_count
+        if len(batch) < batch_size:
+            break
+    return archived
+
+class ResultRetention:
+    """Runs archive_unpaid_results every ``interval`` seconds in the app.
+
+    A lease in ``jobs`` keeps concurrent app processes from archiving at the
+    same time; ``interval`` 0 leaves retention to the CLI.
+    """
+
+    JOB_ID = "result_retention"
+
+    def __init__(self, db, archive: ResultArchive, unpaid_days: int = 30, batch_size: int = 500, interval: float = 0.0):
+        self.db = db
+        self.archive = archive
+        self.unpaid_days = unpaid_days
+        self.batch_size = batch_size
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+        self.archived = 0
+
+    async def start(self) -> None:
+        await self.archive.ensure_indexes()
+        if self.interval > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def run_once(self) -> int:
+        archived = await archive_unpaid_results(self.db, self.archive, timedelta(days=self.unpaid_days), self.batch_size)
+        await asyncio.to_thread(self.archive.prune_segments)
+        self.archived += archived
+        return archived
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                if await acquire_lease(self.db, self.JOB_ID, self.interval * 0.9):
+                    archived = await self.run_once()
+                    if archived:
+                        logger.info(f"Archived {archived} unpaid results")
+            except Exception as e:
+                logger.error(f"Result retention failed: {e}")
+
+    def stats(self) -> Dict:
+        return {"archived": self.archived, **self.archive.stats()}
+
+def create_result_archive(db, settings: Dict[str, str]) -> ResultArchive:
+    return ResultArchive(
+        db,
+        segment_dir=settings.get("RETENTION_SEGMENT_DIR") or None,
+        ttl_days=int(settings.get("RETENTION_ARCHIVE_TTL_DAYS", "0")),
+    )
+
+async def main() -> None:
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    parser = argparse.ArgumentParser(description="Archive unpaid quiz results")
+    parser.add_argument("--unpaid-days", type=int, help="archive unpaid results older than this (default RETENTION_UNPAID_DAYS or 30)")
+    parser.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args()
+
+    load_dotenv(Path(__file__).parent / '.env')
+    client = AsyncIOMotorClient(os.environ["MONGO_URL"])
+    db = client[os.environ["DB_NAME"]]
+    try:
+        archive = create_result_archive(db, os.environ)
+        await archive.ensure_indexes()
+        unpaid_days = args.unpaid_days or int(os.environ.get("RETENTION_UNPAID_DAYS", "30"))
+        archived = await archive_unpaid_results(db, archive, timedelta(days=unpaid_days), args.batch_size)
+        print(f"Archived {archived} unpaid results older than {unpaid_days} days")
+        print(f"Removed {archive.prune_segments()} expired segment files")
+    finally:
+        client.close()
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main())
@@ -0,0 +1,306 @@
+import argparse
+import asyncio
+import logging
+import os
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+from dotenv import load_dotenv
+from pymongo import UpdateOne
+
+from scoring import ScoringRegistry, default_registry
+
+logger = logging.getLogger(__name__)
+
+# Aggregate statistics over quiz_results without aggregating quiz_results.
+# Each process counts what it scores into an in-memory Rollup and
+# periodically $inc's the counts into one stats_rollups document per hour
+# (per day once compacted). Totals are the sum of those documents, reloaded
+# every refresh interval, plus whatever this process hasn't flushed yet.
+HOUR_FORMAT = "%Y-%m-%dT%H"
+DAY_FORMAT = "%Y-%m-%d"
+
+class Rollup:
+    """Counts for one bucket: score histograms, archetypes, modifiers, payments."""
+
+    def __init__(self):
+        self.total = 0
+        self.paid = 0
+        self.hist: Dict[str, Counter] = {}
+        self.primary: Counter = Counter()
+        self.paid_primary: Counter = Counter()
+        self.mods: Counter = Counter()
+
+    def __bool__(self) -> bool:
+        return bool(self.total or self.paid)
+
+    def add_submission(self, teaser: Dict) -> None:
+        self.total += 1
+        for key, value in teaser["scores"].items():
+            if not key.endswith("_tag"):
+                self.hist.setdefault(key, Counter())[value] += 1
+        self.primary[teaser["primary"]] += 1
+        self.mods.update(teaser["mods"])
+
+    def add_payment(self, primary: str) -> None:
+        self.paid += 1
+        self.paid_primary[primary] += 1
+
+    def merge(self, other: "Rollup") -> None:
+        self.total += other.total
+        self.paid += other.paid
+        for key, counts in other.hist.items():
+            self.hist.setdefault(key, Counter()).update(counts)
+        self.primary.update(other.primary)
+        self.paid_primary.update(other.paid_primary)
+        self.mods.update(other.mods)
+
+    def to_inc(self) -> Dict[str, int]:
+        inc = {"total": self.total, "paid": self.paid}
+        for key, counts in self.hist.items():
+            for value, count in counts.items():
+                inc[f"hist.{key}.{value}"] = count
+        for field in ("primary", "paid_primary", "mods"):
+            for name, count in getattr(self, field).items():
+                inc[f"{field}.{name}"] = count
+        return {path: count for path, count in inc.items() if count}
+
+    @classmethod
+    def from_doc(cls, doc: Dict) -> "Rollup":
+        rollup = cls()
+        rollup.total = doc.get("total", 0)
+        rollup.paid = doc.get("paid", 0)
+        rollup.hist = {
+            key: Counter({int(value): count for value, count in counts.items()})
+            for key, counts in doc.get("hist", {}).items()
+        }
+        for field in ("primary", "paid_primary", "mods"):
+            setattr(rollup, field, Counter(doc.get(field, {})))
+        return rollup
+
+class ResultRollups:
+    """Live totals plus O(1) percentile ranks from the score histograms."""
+
+    def __init__(self, db, registry: ScoringRegistry, flush_interval: float = 10.0, refresh_interval: float = 300.0):
+        self.db = db
+        self.registry = registry
+        self.flush_interval = flush_interval
+        self.refresh_interval = refresh_interval
+        self.totals = Rollup()
+        self._pending: Dict[str, Rollup] = {}
+        self._below: Dict[str, List[int]] = {}
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        await self.refresh()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+
+    def _bucket(self, at: Optional[datetime] = None) -> Rollup:
+        bucket_id = f"hour:{(at or datetime.now(timezone.utc)).strftime(HOUR_FORMAT)}"
+        rollup = self._pending.get(bucket_id)
+        if rollup is None:
+            rollup = self._pending[bucket_id] = Rollup()
+        return rollup
+
+    def record_submission(self, teaser: Dict) -> None:
+        self._bucket().add_submission(teaser)
+        self.totals.add_submission(teaser)
+        self._below.clear()
+
+    def record_payment(self, primary: str) -> None:
+        self._bucket().add_payment(primary)
+        self.totals.add_payment(primary)
+
+    async def flush(self) -> None:
+        async with self._lock:
+            pending, self._pending = self._pending, {}
+            ops = [
+                UpdateOne({"_id": bucket_id}, {"$inc": rollup.to_inc(), "$setOnInsert": {"kind": "hour"}}, upsert=True)
+                for bucket_id, rollup in pending.items() if rollup
+            ]
+            if not ops:
+                return
+            try:
+                await self.db.stats_rollups.bulk_write(ops, ordered=False)
+            except Exception:
+                # Keep the counts for the next flush.
+                for bucket_id, rollup in pending.items():
+                    self._pending.setdefault(bucket_id, Rollup()).merge(rollup)
+                raise
+
+    async def refresh(self) -> None:
+        """Reload totals from every process's flushed buckets."""
+        async with self._lock:
+            totals = Rollup()
+            async for doc in self.db.stats_rollups.find({}):
+                totals.merge(Rollup.from_doc(doc))
+            for rollup in self._pending.values():
+                totals.merge(rollup)
+            self.totals = totals
+            self._below.clear()
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        next_refresh = loop.time() + self.refresh_interval
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+                if loop.time() >= next_refresh:
+                    await self.refresh()
+                    next_refresh = loop.time() + self.refresh_interval
+            except Exception as e:
+                logger.error(f"Rollup flush failed: {e}")
+
+    def _below_counts(self, key: str) -> List[int]:
+        # below[s - lo] = number of results scoring strictly less than s;
+        # rebuilt lazily after new submissions, one pass over a small range.
+        below = self._below.get(key)
+        if below is None:
+            lo, hi = self.registry.current.ranges[key]
+            counts = self.totals.hist.get(key, Counter())
+            below, running = [], 0
+            for score in range(lo, hi + 1):
+                below.append(running)
+                running += counts.get(score, 0)
+            self._below[key] = below
+        return below
+
+    def percentiles(self, scores: Dict[str, int]) -> Dict[str, Optional[float]]:
+        """Percent of all results scoring strictly lower, per score."""
+        ranks = {}
+        total = self.totals.total
+        for key in self.registry.current.score_keys:
+            value = scores.get(key)
+            lo, hi = self.registry.current.ranges[key]
+            if not total or value is None or not lo <= value <= hi:
+                ranks[key] = None
+                continue
+            ranks[key] = round(100.0 * self._below_counts(key)[value - lo] / total, 1)
+        return ranks
+
+    def distribution(self) -> Dict:
+        totals = self.totals
+        return {
+            "total": totals.total,
+            "paid": totals.paid,
+            "primary": dict(totals.primary.most_common()),
+            "paid_primary": dict(totals.paid_primary.most_common()),
+            "mods": dict(totals.mods.most_common()),
+            "histograms": {
+                key: {str(value): count for value, count in sorted(counts.items())}
+                for key, counts in totals.hist.items()
+            },
+        }
+
+async def compact_rollups(db, older_than_days: int = 2) -> int:
+    """Merge hourly buckets of days older than ``older_than_days`` into day buckets.
+
+    Run from one place at a time (the CLI); the merge isn't atomic with
+    respect to another compaction of the same day.
+    """
+    cutoff = (datetime.now(timezone.utc) - timedelta(days=older_than_days)).strftime(DAY_FORMAT)
+    days: Dict[str, Rollup] = {}
+    merged_ids = []
+    async for doc in db.stats_rollups.find({"kind": "hour", "_id": {"$lt": f"hour:{cutoff}"}}):
+        day = doc["_id"][len("hour:"):len("hour:") + 10]
+        days.setdefault(day, Rollup()).merge(Rollup.from_doc(doc))
+        merged_ids.append(doc["_id"])
+    if not merged_ids:
+        return 0
+    await db.stats_rollups.bulk_write(
+        [
+            UpdateOne({"_id": f"day:{day}"}, {"$inc": rollup.to_inc(), "$setOnInsert": {"kind": "day"}}, upsert=True)
+            for day, rollup in days.items()
+        ],
+        ordered=False
+    )
+    await db.stats_rollups.delete_many({"_id": {"$in": merged_ids}})
+    return len(merged_ids)
+
+def _teasers(docs: Iterable[Dict], registry: ScoringRegistry):
+    for doc in docs:
+        if "teaser_results" in doc:
+            yield doc, doc["teaser_results"]
+        elif "sums" in doc:
+            yield doc, registry.get(doc["scoring_version"]).lookup(doc["sums"]).teaser
+
+async def rebuild_rollups(db, registry: ScoringRegistry, batch_size: int = 1000) -> int:
+    """Recount stats_rollups from quiz_results into day buckets (backfill).
+
+    Replaces existing rollups; run while nothing is submitting, or expect
+    the counts flushed during the rebuild to be lost.
+    """
+    days: Dict[str, Rollup] = {}
+    count = 0
+    cursor = db.quiz_results.find(
+        {},
+        {"_id": 0, "created_at": 1, "is_paid": 1, "scoring_version": 1, "sums": 1, "teaser_results": 1}
+    ).batch_size(batch_size)
+    docs = []
+    async for doc in cursor:
+        docs.append(doc)
+        if len(docs) >= batch_size:
+            count += _count_into(days, docs, registry)
+            docs = []
+    count += _count_into(days, docs, registry)
+
+    await db.stats_rollups.delete_many({})
+    if days:
+        await db.stats_rollups.insert_many([
+            {"_id": f"day:{day}", "kind": "day", **_nested(rollup.to_inc())} for day, rollup in days.items()
+        ])
+    return count
+
+def _count_into(days: Dict[str, Rollup], docs: List[Dict], registry: ScoringRegistry) -> int:
+    count = 0
+    for doc, teaser in _teasers(docs, registry):
+        rollup = days.setdefault(str(doc.get("created_at", ""))[:10] or "unknown", Rollup())
+        rollup.add_submission(teaser)
+        if doc.get("is_paid"):
+            rollup.add_payment(teaser["primary"])
+        count += 1
+    return count
+
+def _nested(flat: Dict[str, int]) -> Dict:
+    doc: Dict = {}
+    for path, value in flat.items():
+        target = doc
+        *parents, leaf = path.split(".")
+        for part in parents:
+            target = target.setdefault(part, {})
+        target[leaf] = value
+    return doc
+
+async def main() -> None:
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    parser = argparse.ArgumentParser(description="Maintain the stats_rollups collection")
+    parser.add_argument("command", choices=("compact", "rebuild"))
+    parser.add_argument("--older-than-days", type=int, default=2)
+    args = parser.parse_args()
+
+    load_dotenv(Path(__file__).parent / '.env')
+    client = AsyncIOMotorClient(os.environ["MONGO_URL"])
+    db = client[os.environ["DB_NAME"]]
+    try:
+        if args.command == "compact":
+            print(f"Compacted {await compact_rollups(db, args.older_than_days)} hourly buckets")
+        else:
+            print(f"Counted {await rebuild_rollups(db, default_registry())} quiz results")
+    finally:
+        client.close()
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main())
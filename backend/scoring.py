@@ -0,0 +1,317 @@
+import itertools
+import json
+import os
+from pathlib import Path
+from typing import List, Dict, Iterator, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+# Quiz specs live in scoring_specs/v<N>.json: questions (with reverse-scored
+# items), which questions feed each score, tag cut points, attachment styles
+# and their archetype copy, and the modifiers layered on top. Each spec is
+# compiled once into a ScoringEngine; results record the version that scored
+# them so older versions can keep serving their own results. An optional
+# "locales" table (locale -> question number -> text) translates the
+# questions; "default_locale" names the language of the main text.
+SPEC_DIR = Path(__file__).parent / "scoring_specs"
+
+class ScoredResult(NamedTuple):
+    teaser: Dict
+    full: Dict
+
+class BatchScores(NamedTuple):
+    sums: Dict[str, np.ndarray]
+    tags: Dict[str, np.ndarray]
+    attach: np.ndarray
+    primary: np.ndarray
+    label: np.ndarray
+    flags: Dict[str, np.ndarray]
+    outcome: np.ndarray
+
+def _matches(when: Dict, sums: Dict[str, int]) -> bool:
+    for key, bounds in when.items():
+        value = sums[key]
+        if "min" in bounds and value < bounds["min"]:
+            return False
+        if "max" in bounds and value > bounds["max"]:
+            return False
+    return True
+
+def _tag_for(rules: List[Dict], value: int) -> Optional[str]:
+    for rule in rules:
+        if value >= rule.get("min", value):
+            return rule["tag"]
+    return None
+
+def _lookup_array(table: Dict[int, object], dtype) -> np.ndarray:
+    out = np.zeros(max(table) + 1, dtype=dtype)
+    for score, value in table.items():
+        out[score] = value
+    return out
+
+class ScoringEngine:
+    """Precomputed evaluator for one version of the quiz spec.
+
+    Besides the raw sums, every field of a result depends only on which band
+    each sum falls into (the bands are cut by the bounds in the attachment
+    style and modifier rules). The tags and the payload for every band
+    combination are built once here and shared by every result, so scoring
+    is a handful of dict lookups however long the copy text gets.
+    """
+
+    def __init__(self, spec: Dict):
+        self.spec = spec
+        self.version: int = spec["version"]
+        self.questions: List[Dict] = spec["questions"]
+        self.question_count = len(self.questions)
+        self.answer_range: Tuple[int, int] = tuple(spec["answer_range"])
+        self.score_keys: List[str] = list(spec["scores"])
+        self.modifiers: List[Dict] = spec["modifiers"]
+        self.max_steps: int = spec["max_steps"]
+
+        answer_lo, answer_hi = self.answer_range
+        column = {q["n"]: i for i, q in enumerate(self.questions)}
+        self._reverse_columns = [column[q["n"]] for q in self.questions if q.get("reverse")]
+        self._columns = {
+            key: [column[n] for n in section["questions"]]
+            for key, section in spec["scores"].items()
+        }
+        self.ranges = {
+            key: (answer_lo * len(columns), answer_hi * len(columns))
+            for key, columns in self._columns.items()
+        }
+
+        self._tags: Dict[str, Dict[int, str]] = {}
+        for key, section in spec["scores"].items():
+            lo, hi = self.ranges[key]
+            self._tags[key] = {s: _tag_for(section["tags"], s) for s in range(lo, hi + 1)}
+            if None in self._tags[key].values():
+                raise ValueError(f"Spec v{self.version}: tags for {key} don't cover {lo}-{hi}")
+
+        # Every rule bound splits a score's range into bands; an outcome is
+        # numbered by its band indexes in _band_keys order (mixed radix).
+        cuts = {key: set() for key in self.score_keys}
+        for rule in spec["attachment_styles"] + self.modifiers:
+            for key, bounds in rule["when"].items():
+                if "min" in bounds:
+                    cuts[key].add(bounds["min"])
+                if "max" in bounds:
+                    cuts[key].add(bounds["max"] + 1)
+        self._band_keys = [key for key in self.score_keys if cuts[key]]
+        self._band_counts = [len(cuts[key]) + 1 for key in self._band_keys]
+        self._bands: Dict[str, Dict[int, int]] = {}
+        representatives: Dict[str, Dict[int, int]] = {}
+        for key in self._band_keys:
+            lo, hi = self.ranges[key]
+            self._bands[key] = {s: sum(1 for cut in cuts[key] if s >= cut) for s in range(lo, hi + 1)}
+            representatives[key] = {}
+            for s, band in self._bands[key].items():
+                representatives[key].setdefault(band, s)
+
+        self._outcome_list: List[Optional[Tuple[Dict, Dict]]] = []
+        for combo in itertools.product(*(range(n) for n in self._band_counts)):
+            sums = {}
+            for key, band in zip(self._band_keys, combo):
+                sums[key] = representatives[key].get(band)
+            # Bands cut outside a score's range never occur.
+            if None in sums.values():
+                self._outcome_list.append(None)
+            else:
+                self._outcome_list.append(self._build_outcome(sums))
+
+        # Array views of the same tables for score_matrix.
+        self._tag_luts = {key: _lookup_array(tags, object) for key, tags in self._tags.items()}
+        self._band_luts = {key: _lookup_array(self._bands[key], np.intp) for key in self._band_keys}
+        outcomes = [o if o is not None else ({}, {}) for o in self._outcome_list]
+        self._attach_lut = np.array([full.get("attach") for _, full in outcomes], dtype=object)
+        self._primary_lut = np.array([full.get("primary") for _, full in outcomes], dtype=object)
+        self._label_lut = np.array([full.get("label") for _, full in outcomes], dtype=object)
+        self._flag_luts = {
+            m["flag"]: np.array([bool(full.get(m["flag"])) for _, full in outcomes], dtype=bool)
+            for m in self.modifiers
+        }
+
+    def build_blocks(self, primary: str, flags: Dict[str, bool]) -> Dict:
+        archetypes = self.spec["archetypes"]
+        fallback = self.spec["attachment_styles"][-1]["archetype"]
+        base = archetypes.get(primary, archetypes[fallback])
+        out = {"what": base["what"], "steps": list(base["steps"]), "script": base["script"]}
+
+        for modifier in self.modifiers:
+            if not flags.get(modifier["flag"]):
+                continue
+            out["what"] += modifier.get("what_append", "")
+            out["steps"] = modifier.get("steps_prepend", []) + out["steps"] + modifier.get("steps_append", [])
+            if "script" in modifier:
+                out["script"] = modifier["script"]
+
+        out["steps"] = out["steps"][:self.max_steps]
+        return out
+
+    def _build_outcome(self, sums: Dict[str, int]) -> Tuple[Dict, Dict]:
+        style = next((s for s in self.spec["attachment_styles"] if _matches(s["when"], sums)), None)
+        if style is None:
+            raise ValueError(f"Spec v{self.version}: no attachment style matches {sums}")
+        attach = style["name"]
+        primary = style["archetype"]
+        flags = {m["flag"]: _matches(m["when"], sums) for m in self.modifiers}
+        mods = tuple(m["name"] for m in self.modifiers if flags[m["flag"]])
+        label = primary
+        if mods:
+            label += " + " + " + ".join(mods)
+        blocks = self.build_blocks(primary, flags)
+
+        # Lists are stored as tuples so the shared payloads can't be mutated
+        # through any single result.
+        teaser = {
+            "label": label,
+            "primary": primary,
+            "mods": mods,
+            "attach": attach,
+            "teaser_what": self.spec["teaser"]["what"].format(primary=primary),
+            "teaser_tip": self.spec["teaser"]["tip"]
+        }
+        full = {
+            "label": label,
+            "primary": primary,
+            "mods": mods,
+            "attach": attach,
+            **flags,
+            "what": blocks["what"],
+            "steps": tuple(blocks["steps"]),
+            "script": blocks["script"]
+        }
+        return teaser, full
+
+    def validate_answers(self, answers: List[int]) -> None:
+        if len(answers) != self.question_count:
+            raise ValueError(f"Must provide exactly {self.question_count} answers")
+        lo, hi = self.answer_range
+        if not all(lo <= a <= hi for a in answers):
+            raise ValueError(f"All answers must be between {lo} and {hi}")
+
+    def compute_sums(self, answers: List[int]) -> Dict[str, int]:
+        values = list(answers)
+        flip = self.answer_range[0] + self.answer_range[1]
+        for i in self._reverse_columns:
+            values[i] = flip - values[i]
+        return {key: sum(values[i] for i in columns) for key, columns in self._columns.items()}
+
+    def lookup(self, sums: Dict[str, int]) -> ScoredResult:
+        code = 0
+        for key, count in zip(self._band_keys, self._band_counts):
+            code = code * count + self._bands[key][sums[key]]
+        teaser_base, full_base = self._outcome_list[code]
+
+        scores = {key: sums[key] for key in self.score_keys}
+        for key in self.score_keys:
+            scores[f"{key}_tag"] = self._tags[key][sums[key]]
+        # Only the top-level dicts and scores are per-result; strings and
+        # tuples are shared references into the precomputed outcomes.
+        return ScoredResult(
+            teaser={"scores": scores, **teaser_base},
+            full={"scores": dict(scores), **full_base},
+        )
+
+    def score(self, answers: List[int]) -> ScoredResult:
+        return self.lookup(self.compute_sums(answers))
+
+    def score_matrix(self, answers) -> BatchScores:
+        # Range-check in int64 before narrowing: int16 would overflow on
+        # out-of-range answers instead of rejecting them.
+        lo, hi = self.answer_range
+        try:
+            matrix = np.asarray(answers, dtype=np.int64)
+        except OverflowError:
+            raise ValueError(f"All answers must be between {lo} and {hi}")
+        except ValueError:
+            raise ValueError(f"Must provide exactly {self.question_count} answers per respondent")
+        if matrix.ndim != 2 or matrix.shape[1] != self.question_count:
+            raise ValueError(f"Must provide exactly {self.question_count} answers per respondent")
+        if matrix.size and (matrix.min() < lo or matrix.max() > hi):
+            raise ValueError(f"All answers must be between {lo} and {hi}")
+        matrix = matrix.astype(np.int16)
+
+        if self._reverse_columns:
+            matrix = matrix.copy()
+            matrix[:, self._reverse_columns] = (lo + hi) - matrix[:, self._reverse_columns]
+        sums = {key: matrix[:, columns].sum(axis=1) for key, columns in self._columns.items()}
+
+        outcome = np.zeros(matrix.shape[0], dtype=np.intp)
+        for key, count in zip(self._band_keys, self._band_counts):
+            outcome = outcome * count + self._band_luts[key][sums[key]]
+
+        return BatchScores(
+            sums=sums,
+            tags={key: self._tag_luts[key][sums[key]] for key in self.score_keys},
+            attach=self._attach_lut[outcome],
+            primary=self._primary_lut[outcome],
+            label=self._label_lut[outcome],
+            flags={flag: lut[outcome] for flag, lut in self._flag_luts.items()},
+            outcome=outcome,
+        )
+
+    def iter_results(self, batch: BatchScores) -> Iterator[ScoredResult]:
+        sums = [batch.sums[key].tolist() for key in self.score_keys]
+        for i, outcome in enumerate(batch.outcome.tolist()):
+            teaser_base, full_base = self._outcome_list[outcome]
+            scores = {key: column[i] for key, column in zip(self.score_keys, sums)}
+            for key in self.score_keys:
+                scores[f"{key}_tag"] = batch.tags[key][i]
+            yield ScoredResult(
+                teaser={"scores": scores, **teaser_base},
+                full={"scores": dict(scores), **full_base},
+            )
+
+class ScoringRegistry:
+    """Compiled engines for every spec version, one of them current.
+
+    New results are scored with ``current``; stored results are read back
+    with the engine for the version recorded on them.
+    """
+
+    def __init__(self, engines: List[ScoringEngine], current_version: Optional[int] = None):
+        self.engines = {engine.version: engine for engine in engines}
+        if not self.engines:
+            raise ValueError("No scoring specs loaded")
+        self.current = self.get(current_version if current_version is not None else max(self.engines))
+
+    @classmethod
+    def load(cls, directory: Path = SPEC_DIR, current_version: Optional[int] = None) -> "ScoringRegistry":
+        engines = []
+        for path in sorted(directory.glob("v*.json")):
+            with open(path) as f:
+                engines.append(ScoringEngine(json.load(f)))
+        return cls(engines, current_version)
+
+    def get(self, version: int) -> ScoringEngine:
+        try:
+            return self.engines[version]
+        except KeyError:
+            raise KeyError(f"Unknown scoring version {version}")
+
+    @property
+    def versions(self) -> List[int]:
+        return sorted(self.engines)
+
+_default_registry: Optional[ScoringRegistry] = None
+
+def default_registry() -> ScoringRegistry:
+    global _default_registry
+    if _default_registry is None:
+        current = os.environ.get("SCORING_VERSION")
+        _default_registry = ScoringRegistry.load(current_version=int(current) if current else None)
+    return _default_registry
+
+# Scoring functions for the current spec
+def compute_scores(answers: List[int]) -> Dict:
+    return default_registry().current.compute_sums(answers)
+
+def build_blocks(primary: str, volcano: bool, picker: bool) -> Dict:
+    return default_registry().current.build_blocks(primary, {"volcano": volcano, "picker": picker})
+
+def compute_full_results(answers: List[int]) -> Dict:
+    return default_registry().current.score(answers).full
+
+def compute_teaser_results(answers: List[int]) -> Dict:
+    return default_registry().current.score(answers).teaser
@@ -1,67 +1,65 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Request
+from fastapi import FastAPI, APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import JSONResponse, ORJSONResponse, PlainTextResponse, StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
 import os
+import hashlib
+import hmac
+import json
+import math
+import asyncio
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field, ConfigDict
-from typing import List, Optional, Dict
+from typing import Callable, List, Optional, Dict
 import uuid
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
 from emergentintegrations.payments.stripe.checkout import (
-    StripeCheckout, 
     CheckoutSessionResponse, 
     CheckoutStatusResponse, 
     CheckoutSessionRequest
 )
+from payments import PaymentGateway, PaymentGatewayTimeout, PaymentGatewayUnavailable, create_payment_gateway
+from admission import AdmissionControlMiddleware, MongoRateLimitBackend, RateLimiter, client_key
+from api_models import (
+    CheckoutSessionCreated,
+    PaymentStatusResponse,
+    QuizBatchSubmitResponse,
+    QuizSubmitResponse,
+    ResultResponse
+)
+from email_outbox import EmailOutbox, create_email_transport
+from export import export_stream
+from ids import uuid7
+from indexes import ensure_indexes
+from metrics import REGISTRY, SCORING_SECONDS, MetricsMiddleware, MongoCommandMetrics, render_metrics
+from payment_events import PaymentEventBroker
+from precompiled import question_payloads
+from reconcile import PaymentReconciler
+from result_cache import ResultCache
+from result_format import compact_fields, expand_result
+from retention import ResultRetention, create_result_archive
+from rollups import ResultRollups
+from single_flight import FlightTimeout, SingleFlight
+from webhooks import WebhookPipeline, unlock_result
+from write_behind import WriteBehindBuffer, WriteBehindFull
+from scoring import default_registry
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+client = AsyncIOMotorClient(mongo_url, event_listeners=[MongoCommandMetrics()])
 db = client[os.environ['DB_NAME']]
 
 # Create the main app without a prefix
-app = FastAPI()
+app = FastAPI(default_response_class=ORJSONResponse)
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
 
-# Quiz Questions Data
-QUESTIONS = [
-    # Attachment Section
-    {"n": 1, "section": "Attachment", "text": "I worry someone I like will lose interest in me."},
-    {"n": 2, "section": "Attachment", "text": "When someone pulls back, I feel a strong urge to fix it right away."},
-    {"n": 3, "section": "Attachment", "text": "I need frequent reassurance that we're okay."},
-    {"n": 4, "section": "Attachment", "text": "I overthink texts, tone, and timing more than I want to."},
-    {"n": 5, "section": "Attachment", "text": "I feel suffocated if someone wants too much closeness."},
-    {"n": 6, "section": "Attachment", "text": "When things get serious, I suddenly want more space."},
-    {"n": 7, "section": "Attachment", "text": "I prefer solving problems alone rather than leaning on a partner."},
-    {"n": 8, "section": "Attachment", "text": "I get uncomfortable with emotional conversations that feel heavy."},
-    # Conflict Section
-    {"n": 9, "section": "Conflict", "text": "I bring up issues as character flaws (you always, you never)."},
-    {"n": 10, "section": "Conflict", "text": "I use sarcasm, eye-roll energy, or put-downs when upset."},
-    {"n": 11, "section": "Conflict", "text": "I defend myself fast instead of hearing the point."},
-    {"n": 12, "section": "Conflict", "text": "I shut down, go quiet, or leave the conversation mentally/physically."},
-    {"n": 13, "section": "Conflict", "text": "I can start conflict gently (complaint + need) instead of attacking.", "reverse": True},
-    {"n": 14, "section": "Conflict", "text": "I can accept repair attempts (softening, pause, reset) mid-argument.", "reverse": True},
-    {"n": 15, "section": "Conflict", "text": "I escalate once I feel misunderstood."},
-    {"n": 16, "section": "Conflict", "text": "After conflict, I struggle to reconnect warmly."},
-    # Patterns Section
-    {"n": 17, "section": "Patterns", "text": "I ignore red flags because the chemistry is strong."},
-    {"n": 18, "section": "Patterns", "text": "I stay longer than I should hoping potential becomes reality."},
-    {"n": 19, "section": "Patterns", "text": "I confuse intensity with compatibility."},
-    {"n": 20, "section": "Patterns", "text": "I'm drawn to emotionally unavailable people."},
-    {"n": 21, "section": "Patterns", "text": "I feel responsible for other people's feelings."},
-    {"n": 22, "section": "Patterns", "text": "I struggle to ask directly for what I want."},
-    {"n": 23, "section": "Patterns", "text": "I tolerate almost treatment (almost commitment, almost consistency)."},
-    {"n": 24, "section": "Patterns", "text": "I test people instead of stating needs (withdraw, jealousy bait, silent treatment, etc.)."},
-    {"n": 25, "section": "Patterns", "text": "I pick partners who fit a fantasy rather than my real life needs."},
-]
-
 # Fixed price package
 QUIZ_PACKAGES = {
     "full_results": 10.00
@@ -84,6 +82,10 @@ class QuizSubmitRequest(BaseModel):
     answers: List[int]
     email: Optional[str] = None
 
+class QuizBatchSubmitRequest(BaseModel):
+    answers: List[List[int]]
+    emails: Optional[List[Optional[str]]] = None
+
 class CheckoutRequest(BaseModel):
     result_id: str
     origin_url: str
@@ -95,277 +97,423 @@ class EmailResultsRequest(BaseModel):
     result_id: str
     email: str
 
-# Scoring functions
-def compute_scores(answers: List[int]) -> Dict:
-    ax = sum(answers[0:4])
-    av = sum(answers[4:8])
-    q13r = 6 - answers[12]
-    q14r = 6 - answers[13]
-    cr = answers[8] + answers[9] + answers[10] + answers[11] + q13r + q14r + answers[14] + answers[15]
-    ps = sum(answers[16:25])
-    return {"ax": ax, "av": av, "cr": cr, "ps": ps}
-
-def tag_attachment(score: int) -> str:
-    if score >= 14:
-        return "High"
-    if score >= 10:
-        return "Moderate"
-    return "Low"
-
-def tag_cr(score: int) -> str:
-    if score >= 28:
-        return "High"
-    if score >= 18:
-        return "Moderate"
-    return "Low"
-
-def tag_ps(score: int) -> str:
-    if score >= 33:
-        return "High"
-    if score >= 21:
-        return "Moderate"
-    return "Low"
-
-def attachment_style(ax: int, av: int) -> str:
-    ax_high = ax >= 14
-    av_high = av >= 14
-    if ax_high and not av_high:
-        return "Anxious-leaning"
-    if not ax_high and av_high:
-        return "Avoidant-leaning"
-    if ax_high and av_high:
-        return "Fearful-avoidant (push-pull)"
-    return "More secure-leaning"
-
-def build_blocks(primary: str, volcano: bool, picker: bool) -> Dict:
-    base = {
-        "The Chaser": {
-            "what": "You bond fast and chase clarity when connection feels uncertain. That urgency can pressure the relationship, especially if the other person is inconsistent or emotionally limited.",
-            "steps": [
-                "Use a 24-hour rule when activated: pause before big texts, decisions, or ultimatums.",
-                "Replace reassurance-seeking with one clear ask: Can we talk tonight? I want closeness and clarity.",
-                "Date for consistency, not intensity: track follow-through and effort over time."
-            ],
-            "script": "I'm feeling activated. I want clarity, not a fight. Let's talk when we're both calm."
-        },
-        "The Escape Artist": {
-            "what": "When things get real, you default to distance. Partners feel shut out, and tough conversations become too much, so connection erodes quietly.",
-            "steps": [
-                "Practice micro-vulnerability daily: one honest sentence instead of disappearing.",
-                "Use a scripted pause and return: I'm flooded. I care. I need 30 minutes and I'm coming back.",
-                "Turn toward bids for connection: small responses build safety fast."
-            ],
-            "script": "I'm overwhelmed. I care about us. I'm taking 30 minutes, then I'll come back to repair."
-        },
-        "The Push-Pull Magnet": {
-            "what": "You want closeness and fear it at the same time. You can bond fast, then doubt, then test, then detach. That creates instability even when feelings are real.",
-            "steps": [
-                "Slow the runway: no major commitments for 6-8 weeks - consistency first.",
-                "Replace tests with direct needs: say the need instead of provoking a reaction.",
-                "Use gentle start-ups and repair attempts early in conflict."
-            ],
-            "script": "I want closeness, and I'm getting scared. I'm going to be direct instead of testing."
-        },
-        "Secure Builder": {
-            "what": "You're relatively secure. If things go wrong, it's usually selection (who you pick), timing, or skill mismatch - not your capacity to love.",
-            "steps": [
-                "State your needs early and watch behavior - not promises.",
-                "Keep standards: consistency and repair matter more than chemistry.",
-                "If conflict repeats, implement a repair ritual or exit cleanly."
-            ],
-            "script": "I'm open to working on this - if we can repair and change the pattern."
-        }
-    }
-    
-    out = base.get(primary, base["Secure Builder"]).copy()
-    out["steps"] = out["steps"].copy()
-    
-    if picker:
-        out["what"] += " You also tend to override your standards when chemistry is strong - then you stay too long hoping potential becomes reality."
-        out["steps"].insert(0, "Create 5 non-negotiables and enforce them. Consistency is the gate; potential does not count.")
-        out["steps"].append("Use an evidence log: if the same red flag appears twice, you exit - no negotiating with the pattern.")
-    
-    if volcano:
-        out["what"] += " Conflict is the multiplier: arguments escalate, repair gets missed, and disconnection follows."
-        out["steps"].insert(0, "Ban the big four in your house: contempt, criticism, defensiveness, stonewalling. Replace with behavior + feeling + need.")
-        out["steps"].append("Install a repair protocol: pause, return, name feeling, make one request, agree on one change.")
-        out["script"] = "I'm activated. I'm pausing so I don't say something I can't take back. I will come back to repair."
-    
-    out["steps"] = out["steps"][:6]
-    return out
+# Scoring specs, compiled once at startup. New results are scored with the
+# current version; stored results are read back with the version they record.
+scoring_registry = default_registry()
 
-def compute_full_results(answers: List[int]) -> Dict:
-    scores = compute_scores(answers)
-    ax, av, cr, ps = scores["ax"], scores["av"], scores["cr"], scores["ps"]
-    
-    attach = attachment_style(ax, av)
-    
-    primary = "Secure Builder"
-    if attach.startswith("Anxious"):
-        primary = "The Chaser"
-    elif attach.startswith("Avoidant"):
-        primary = "The Escape Artist"
-    elif attach.startswith("Fearful"):
-        primary = "The Push-Pull Magnet"
-    
-    volcano = cr >= 28
-    picker = ps >= 33
-    
-    mods = []
-    if picker:
-        mods.append("Pattern Picker")
-    if volcano:
-        mods.append("Volcano")
-    
-    label = primary
-    if mods:
-        label += " + " + " + ".join(mods)
-    
-    blocks = build_blocks(primary, volcano, picker)
-    
-    return {
-        "scores": {
-            "ax": ax,
-            "av": av,
-            "cr": cr,
-            "ps": ps,
-            "ax_tag": tag_attachment(ax),
-            "av_tag": tag_attachment(av),
-            "cr_tag": tag_cr(cr),
-            "ps_tag": tag_ps(ps)
-        },
-        "label": label,
-        "primary": primary,
-        "mods": mods,
-        "attach": attach,
-        "volcano": volcano,
-        "picker": picker,
-        "what": blocks["what"],
-        "steps": blocks["steps"],
-        "script": blocks["script"]
-    }
+# /quiz/questions is the busiest read and never changes between deploys, so
+# its body (per locale and encoding) is encoded once here.
+questions_response = question_payloads(
+    scoring_registry.current,
+    cache_control=f"public, max-age={int(os.environ.get('QUESTIONS_CACHE_MAX_AGE', '300'))}"
+)
 
-def compute_teaser_results(answers: List[int]) -> Dict:
-    scores = compute_scores(answers)
-    ax, av, cr, ps = scores["ax"], scores["av"], scores["cr"], scores["ps"]
-    attach = attachment_style(ax, av)
-    
-    primary = "Secure Builder"
-    if attach.startswith("Anxious"):
-        primary = "The Chaser"
-    elif attach.startswith("Avoidant"):
-        primary = "The Escape Artist"
-    elif attach.startswith("Fearful"):
-        primary = "The Push-Pull Magnet"
-    
-    volcano = cr >= 28
-    picker = ps >= 33
-    
-    mods = []
-    if picker:
-        mods.append("Pattern Picker")
-    if volcano:
-        mods.append("Volcano")
-    
-    label = primary
-    if mods:
-        label += " + " + " + ".join(mods)
-    
+def new_result_document(result_id: str, answers: List[int], email: Optional[str], sums: Dict[str, int], created_at: Optional[str] = None) -> Dict:
     return {
-        "scores": {
-            "ax": ax,
-            "av": av,
-            "cr": cr,
-            "ps": ps,
-            "ax_tag": tag_attachment(ax),
-            "av_tag": tag_attachment(av),
-            "cr_tag": tag_cr(cr),
-            "ps_tag": tag_ps(ps)
-        },
-        "label": label,
-        "primary": primary,
-        "mods": mods,
-        "attach": attach,
-        "teaser_what": f"As a {primary}, you have specific patterns in how you connect with others...",
-        "teaser_tip": "Unlock your full analysis to discover what tends to go wrong and exactly how to improve."
+        "id": result_id,
+        **compact_fields(answers, sums, scoring_registry.current.version),
+        "email": email,
+        "is_paid": False,
+        "created_at": created_at or datetime.now(timezone.utc).isoformat()
     }
 
+# Read-through cache for result documents. Entries are invalidated wherever a
+# result document changes or is seen paid; the TTL bounds staleness across
+# processes.
+result_cache = ResultCache(
+    max_entries=int(os.environ.get("RESULT_CACHE_MAX_ENTRIES", "10000")),
+    ttl_seconds=float(os.environ.get("RESULT_CACHE_TTL_SECONDS", "30")),
+)
+
+# Concurrent cache misses for one result_id share a single find_one
+result_loads = SingleFlight("result_load", timeout=float(os.environ.get("RESULT_LOAD_TIMEOUT_SECONDS", "10")))
+
+# Optional write-behind mode for /quiz/submit: submissions are acknowledged
+# once buffered and written with insert_many by a background flusher.
+submission_buffer: Optional[WriteBehindBuffer] = None
+if os.environ.get("SUBMIT_WRITE_BEHIND", "").lower() in ("1", "true", "yes"):
+    submission_buffer = WriteBehindBuffer(
+        db.quiz_results,
+        max_pending=int(os.environ.get("SUBMIT_BUFFER_MAX", "10000")),
+        batch_size=int(os.environ.get("SUBMIT_BATCH_SIZE", "500")),
+        flush_interval=float(os.environ.get("SUBMIT_FLUSH_INTERVAL_SECONDS", "0.05")),
+        flush_when_full=os.environ.get("SUBMIT_FLUSH_WHEN_FULL", "true").lower() in ("1", "true", "yes"),
+        flush_on_shutdown=os.environ.get("SUBMIT_FLUSH_ON_SHUTDOWN", "true").lower() in ("1", "true", "yes"),
+    )
+
+# Unpaid results past the retention window live in quiz_results_archive
+result_archive = create_result_archive(db, os.environ)
+result_retention = ResultRetention(
+    db,
+    result_archive,
+    unpaid_days=int(os.environ.get("RETENTION_UNPAID_DAYS", "30")),
+    interval=float(os.environ.get("RETENTION_INTERVAL_SECONDS", "0")),
+)
+
+def buffered_result(result_id: str) -> Optional[Dict]:
+    if submission_buffer is None:
+        return None
+    return submission_buffer.get(result_id)
+
+async def load_result(result_id: str) -> Optional[Dict]:
+    buffered = buffered_result(result_id)
+    if buffered is not None:
+        return buffered
+    return await result_cache.get_or_load(result_id, lambda: result_loads.do(result_id, lambda: find_result(result_id)))
+
+async def find_result(result_id: str) -> Optional[Dict]:
+    result = await db.quiz_results.find_one({"id": result_id}, {"_id": 0})
+    if result is None:
+        result = await result_archive.get(result_id)
+    return result
+
+# Wakes clients waiting on /results/{id}/events when a result is unlocked
+payment_events = PaymentEventBroker()
+PAYMENT_EVENTS_TIMEOUT_SECONDS = float(os.environ.get("PAYMENT_EVENTS_TIMEOUT_SECONDS", "60"))
+PAYMENT_EVENTS_KEEPALIVE_SECONDS = 15.0
+
+# Score histograms and archetype counters for percentiles and dashboards
+result_rollups = ResultRollups(
+    db,
+    scoring_registry,
+    flush_interval=float(os.environ.get("ROLLUP_FLUSH_SECONDS", "10")),
+    refresh_interval=float(os.environ.get("ROLLUP_REFRESH_SECONDS", "300")),
+)
+
+async def forget_result(result_id: str):
+    # Also for payments another process applied: this one may still hold
+    # the unpaid document.
+    result_loads.forget(result_id)
+    await result_cache.invalidate(result_id)
+
+async def publish_unlock(result_id: str):
+    result = await load_result(result_id)
+    if result:
+        result_rollups.record_payment(expand_result(result, scoring_registry).teaser["primary"])
+    await forget_result(result_id)
+    await payment_events.publish(result_id, {"type": "paid", "result_id": result_id, "is_paid": True})
+
+# Payment webhooks are recorded once and applied by background workers
+webhook_pipeline = WebhookPipeline(
+    db,
+    on_unlock=publish_unlock,
+    on_paid=forget_result,
+    workers=int(os.environ.get("WEBHOOK_WORKERS", "2")),
+    batch_size=int(os.environ.get("WEBHOOK_BATCH_SIZE", "100")),
+    retry_interval=float(os.environ.get("WEBHOOK_RETRY_SECONDS", "60")),
+)
+
+async def paid_full_results(result_id: str) -> Optional[Dict]:
+    result = await load_result(result_id)
+    if not result or not result.get("is_paid"):
+        return None
+    return expand_result(result, scoring_registry).full
+
+async def record_email_sent(job: Dict):
+    await db.quiz_results.update_one(
+        {"id": job["result_id"]},
+        {"$set": {"emailed_to": job["to"], "emailed_at": job["sent_at"]}}
+    )
+    await result_cache.invalidate(job["result_id"])
+
+# Result emails are queued in email_outbox and sent by background workers
+email_outbox = EmailOutbox(
+    db,
+    create_email_transport(os.environ),
+    load_payload=paid_full_results,
+    on_sent=record_email_sent,
+    sender=os.environ.get("EMAIL_FROM", "results@localhost"),
+    results_url=os.environ.get("FRONTEND_URL"),
+    workers=int(os.environ.get("EMAIL_WORKERS", "2")),
+    max_attempts=int(os.environ.get("EMAIL_MAX_ATTEMPTS", "5")),
+)
+
+# Per-client token buckets for the routes that write (and pay)
+RATE_LIMIT_KEY = os.environ.get("RATE_LIMIT_KEY", "ip")
+# Number of proxies (ingress, load balancer) that append to X-Forwarded-For.
+# The app is deployed behind one ingress; 0 would put every client in the
+# ingress's bucket.
+RATE_LIMIT_TRUSTED_PROXIES = int(os.environ.get("RATE_LIMIT_TRUSTED_PROXIES", "1"))
+# "memory" limits each process on its own; "mongo" shares the buckets, so the
+# limits hold across processes at one extra round-trip per limited request.
+rate_limit_backend = MongoRateLimitBackend(db.rate_limits) if os.environ.get("RATE_LIMIT_BACKEND", "memory") == "mongo" else None
+submit_limiter = RateLimiter(
+    "submit",
+    per_minute=float(os.environ.get("RATE_LIMIT_SUBMIT_PER_MINUTE", "30")),
+    burst=float(os.environ.get("RATE_LIMIT_SUBMIT_BURST", "10")),
+    backend=rate_limit_backend,
+)
+checkout_limiter = RateLimiter(
+    "checkout",
+    per_minute=float(os.environ.get("RATE_LIMIT_CHECKOUT_PER_MINUTE", "10")),
+    burst=float(os.environ.get("RATE_LIMIT_CHECKOUT_BURST", "5")),
+    backend=rate_limit_backend,
+)
+# Result emails go to any address the caller names, so they're limited too.
+email_limiter = RateLimiter(
+    "email",
+    per_minute=float(os.environ.get("RATE_LIMIT_EMAIL_PER_MINUTE", "5")),
+    burst=float(os.environ.get("RATE_LIMIT_EMAIL_BURST", "3")),
+    backend=rate_limit_backend,
+)
+# Authenticated bulk imports, per partner token rather than per IP
+partner_limiter = RateLimiter(
+    "partner",
+    per_minute=float(os.environ.get("RATE_LIMIT_PARTNER_PER_MINUTE", "600")),
+    burst=float(os.environ.get("RATE_LIMIT_PARTNER_BURST", "100")),
+    backend=rate_limit_backend,
+)
+
+def request_client_key(request: Request) -> str:
+    return client_key(request.scope, trusted_proxies=RATE_LIMIT_TRUSTED_PROXIES, by=RATE_LIMIT_KEY)
+
+def bearer_token_key(request: Request) -> str:
+    # A digest, so tokens don't end up as keys in a rate limit backend.
+    token = request.headers.get("Authorization", "").partition(" ")[2]
+    return hashlib.sha256(token.encode()).hexdigest()[:16]
+
+def rate_limited(limiter: RateLimiter, key: Callable[[Request], str] = request_client_key):
+    async def check(request: Request):
+        allowed, retry_after = await limiter.check(key(request))
+        if not allowed:
+            raise HTTPException(
+                status_code=429,
+                detail="Too many requests, please slow down",
+                headers={"Retry-After": str(max(1, math.ceil(retry_after)))}
+            )
+    return check
+
+def require_bearer(request: Request, tokens: List[str], label: str):
+    tokens = [token for token in tokens if token]
+    if not tokens:
+        raise HTTPException(status_code=404, detail="Not Found")
+    scheme, _, presented = request.headers.get("Authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not any(
+        hmac.compare_digest(presented.encode(), token.encode()) for token in tokens
+    ):
+        raise HTTPException(status_code=401, detail=f"Invalid {label} token", headers={"WWW-Authenticate": "Bearer"})
+
+def require_admin(request: Request):
+    require_bearer(request, [os.environ.get("ADMIN_TOKEN", "")], "admin")
+
+def require_partner(request: Request):
+    # Bulk imports: any of the comma-separated PARTNER_TOKENS, or the admin token.
+    tokens = os.environ.get("PARTNER_TOKENS", "").split(",") + [os.environ.get("ADMIN_TOKEN", "")]
+    require_bearer(request, [token.strip() for token in tokens], "partner")
+
+BATCH_SUBMIT_MAX_ROWS = int(os.environ.get("BATCH_SUBMIT_MAX_ROWS", "1000"))
+
+# Periodically settles pending transactions whose webhook never arrived
+payment_reconciler = PaymentReconciler(
+    db,
+    get_gateway=lambda: payment_gateway,
+    on_unlock=publish_unlock,
+    batch_size=int(os.environ.get("RECONCILE_BATCH_SIZE", "200")),
+    concurrency=int(os.environ.get("RECONCILE_CONCURRENCY", "10")),
+    min_age=timedelta(seconds=float(os.environ.get("RECONCILE_MIN_AGE_SECONDS", "300"))),
+    interval=float(os.environ.get("RECONCILE_INTERVAL_SECONDS", "300")),
+    on_paid=forget_result,
+)
+
+def sse_message(event: str, data: Dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+# Payment gateway, built once on startup and shared by the checkout routes
+payment_gateway: Optional[PaymentGateway] = None
+
+# Concurrent polls for one session share a provider call and its writes
+checkout_status_checks = SingleFlight(
+    "checkout_status",
+    timeout=float(os.environ.get("CHECKOUT_STATUS_TIMEOUT_SECONDS", "30"))
+)
+
+def get_payment_gateway(http_request: Request) -> PaymentGateway:
+    if payment_gateway is None:
+        raise HTTPException(status_code=500, detail="Payment not configured")
+    payment_gateway.bind_webhook_url(str(http_request.base_url))
+    return payment_gateway
+
 # Routes
 @api_router.get("/")
 async def root():
     return {"message": "Love Life Debugger API"}
 
 @api_router.get("/quiz/questions")
-async def get_questions():
-    return {"questions": QUESTIONS}
+async def get_questions(request: Request, locale: Optional[str] = None):
+    return questions_response.respond(request, locale)
 
-@api_router.post("/quiz/submit")
+@api_router.post("/quiz/submit", response_model=QuizSubmitResponse, dependencies=[Depends(rate_limited(submit_limiter))])
 async def submit_quiz(request: QuizSubmitRequest):
-    if len(request.answers) != 25:
-        raise HTTPException(status_code=400, detail="Must provide exactly 25 answers")
-    
-    if not all(1 <= a <= 5 for a in request.answers):
-        raise HTTPException(status_code=400, detail="All answers must be between 1 and 5")
-    
-    result_id = str(uuid.uuid4())
-    teaser = compute_teaser_results(request.answers)
-    full = compute_full_results(request.answers)
+    engine = scoring_registry.current
+    try:
+        engine.validate_answers(request.answers)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    result_id = uuid7()
+    with SCORING_SECONDS.time("compute_sums"):
+        sums = engine.compute_sums(request.answers)
+    with SCORING_SECONDS.time("lookup"):
+        scored = engine.lookup(sums)
+    doc = new_result_document(result_id, request.answers, request.email, sums)
+    
+    if submission_buffer is not None:
+        await submission_buffer.add(doc)
+    else:
+        await db.quiz_results.insert_one(doc)
+    result_rollups.record_submission(scored.teaser)
     
-    doc = {
-        "id": result_id,
-        "answers": request.answers,
-        "email": request.email,
-        "teaser_results": teaser,
-        "full_results": full,
-        "is_paid": False,
-        "created_at": datetime.now(timezone.utc).isoformat()
+    return {
+        "result_id": result_id,
+        "teaser": scored.teaser,
+        "is_paid": False
     }
+
+@api_router.post(
+    "/quiz/submit/batch",
+    response_model=QuizBatchSubmitResponse,
+    dependencies=[Depends(require_partner), Depends(rate_limited(partner_limiter, key=bearer_token_key))]
+)
+async def submit_quiz_batch(request: QuizBatchSubmitRequest):
+    if not request.answers:
+        raise HTTPException(status_code=400, detail="Must provide at least one set of answers")
+    if len(request.answers) > BATCH_SUBMIT_MAX_ROWS:
+        raise HTTPException(status_code=413, detail=f"At most {BATCH_SUBMIT_MAX_ROWS} answer sets per batch")
+    
+    emails = request.emails
+    if emails is None:
+        emails = [None] * len(request.answers)
+    elif len(emails) != len(request.answers):
+        raise HTTPException(status_code=400, detail="emails must match the number of answer sets")
     
-    await db.quiz_results.insert_one(doc)
+    try:
+        with SCORING_SECONDS.time("score_matrix"):
+            batch = scoring_registry.current.score_matrix(request.answers)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    created_at = datetime.now(timezone.utc).isoformat()
+    keys = list(batch.sums)
+    columns = zip(*(batch.sums[key].tolist() for key in keys))
+    docs = [
+        new_result_document(uuid7(), answers, email, dict(zip(keys, sums)), created_at)
+        for answers, email, sums in zip(request.answers, emails, columns)
+    ]
+    
+    await db.quiz_results.insert_many(docs, ordered=False)
+    for scored in scoring_registry.current.iter_results(batch):
+        result_rollups.record_submission(scored.teaser)
     
     return {
-        "result_id": result_id,
-        "teaser": teaser,
-        "is_paid": False
+        "count": len(docs),
+        "result_ids": [doc["id"] for doc in docs]
     }
 
-@api_router.get("/results/{result_id}")
+@api_router.get("/results/{result_id}", response_model=ResultResponse, response_model_exclude_none=True)
 async def get_results(result_id: str):
-    result = await db.quiz_results.find_one({"id": result_id}, {"_id": 0})
+    result = await load_result(result_id)
     
     if not result:
         raise HTTPException(status_code=404, detail="Result not found")
     
+    with SCORING_SECONDS.time("expand_result"):
+        scored = expand_result(result, scoring_registry)
     if result.get("is_paid"):
         return {
             "result_id": result_id,
             "is_paid": True,
-            "results": result["full_results"]
+            "results": scored.full
         }
     else:
         return {
             "result_id": result_id,
             "is_paid": False,
-            "teaser": result["teaser_results"]
+            "teaser": scored.teaser
         }
 
-@api_router.post("/checkout/session")
+@api_router.get("/results/{result_id}/percentiles")
+async def get_result_percentiles(result_id: str):
+    result = await load_result(result_id)
+    
+    if not result:
+        raise HTTPException(status_code=404, detail="Result not found")
+    
+    scores = expand_result(result, scoring_registry).teaser["scores"]
+    return {
+        "result_id": result_id,
+        "sample_size": result_rollups.totals.total,
+        "percentiles": result_rollups.percentiles(scores)
+    }
+
+@api_router.get("/results/{result_id}/events")
+async def result_events(result_id: str, http_request: Request):
+    # Subscribe before reading the document so an unlock landing in between
+    # is still delivered.
+    subscription = payment_events.subscribe(result_id)
+    result = buffered_result(result_id) or await db.quiz_results.find_one({"id": result_id}, {"_id": 0, "is_paid": 1})
+    if not result:
+        subscription.close()
+        raise HTTPException(status_code=404, detail="Result not found")
+    
+    async def stream():
+        try:
+            if result.get("is_paid"):
+                yield sse_message("paid", {"type": "paid", "result_id": result_id, "is_paid": True})
+                return
+            
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + PAYMENT_EVENTS_TIMEOUT_SECONDS
+            while True:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    yield sse_message("timeout", {"type": "timeout", "result_id": result_id, "is_paid": False})
+                    return
+                try:
+                    event = await asyncio.wait_for(
+                        subscription.get(),
+                        timeout=min(remaining, PAYMENT_EVENTS_KEEPALIVE_SECONDS)
+                    )
+                except asyncio.TimeoutError:
+                    if await http_request.is_disconnected():
+                        return
+                    yield ": keepalive\n\n"
+                    continue
+                yield sse_message(event["type"], event)
+                return
+        finally:
+            subscription.close()
+    
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@api_router.post(
+    "/checkout/session",
+    response_model=CheckoutSessionCreated,
+    dependencies=[Depends(rate_limited(checkout_limiter))]
+)
 async def create_checkout_session(request: CheckoutRequest, http_request: Request):
-    result = await db.quiz_results.find_one({"id": request.result_id}, {"_id": 0})
+    # A result must be in Mongo before it can be paid for and unlocked.
+    if submission_buffer is not None:
+        await submission_buffer.ensure_written(request.result_id)
+    # checkout_started_at keeps retention from archiving it while it's paid for.
+    started_at = datetime.now(timezone.utc).isoformat()
+    result = await db.quiz_results.find_one_and_update(
+        {"id": request.result_id},
+        {"$set": {"checkout_started_at": started_at}},
+        projection={"_id": 0}
+    )
+    if not result:
+        result = await result_archive.restore(db, request.result_id, checkout_started_at=started_at)
     if not result:
         raise HTTPException(status_code=404, detail="Result not found")
     
     if result.get("is_paid"):
         raise HTTPException(status_code=400, detail="Results already unlocked")
     
-    api_key = os.environ.get("STRIPE_API_KEY")
-    if not api_key:
-        raise HTTPException(status_code=500, detail="Payment not configured")
-    
-    host_url = str(http_request.base_url).rstrip('/')
-    webhook_url = f"{host_url}/api/webhook/stripe"
-    
-    stripe_checkout = StripeCheckout(api_key=api_key, webhook_url=webhook_url)
+    gateway = get_payment_gateway(http_request)
     
     success_url = f"{request.origin_url}/results/{request.result_id}?session_id={{CHECKOUT_SESSION_ID}}"
     cancel_url = f"{request.origin_url}/results/{request.result_id}"
@@ -381,10 +529,10 @@ async def create_checkout_session(request: CheckoutRequest, http_request: Reques
         }
     )
     
-    session = await stripe_checkout.create_checkout_session(checkout_request)
+    session = await gateway.create_checkout_session(checkout_request)
     
     transaction = {
-        "id": str(uuid.uuid4()),
+        "id": uuid7(),
         "session_id": session.session_id,
         "result_id": request.result_id,
         "amount": QUIZ_PACKAGES["full_results"],
@@ -396,46 +544,36 @@ async def create_checkout_session(request: CheckoutRequest, http_request: Reques
     
     return {"url": session.url, "session_id": session.session_id}
 
-@api_router.get("/checkout/status/{session_id}")
-async def get_checkout_status(session_id: str, http_request: Request):
-    api_key = os.environ.get("STRIPE_API_KEY")
-    if not api_key:
-        raise HTTPException(status_code=500, detail="Payment not configured")
-    
-    host_url = str(http_request.base_url).rstrip('/')
-    webhook_url = f"{host_url}/api/webhook/stripe"
-    
-    stripe_checkout = StripeCheckout(api_key=api_key, webhook_url=webhook_url)
-    
-    status = await stripe_checkout.get_checkout_status(session_id)
+async def refresh_checkout_status(gateway: PaymentGateway, session_id: str):
+    status = await gateway.get_checkout_status(session_id)
+    now = datetime.now(timezone.utc).isoformat()
     
-    await db.payment_transactions.update_one(
+    # Two round-trips at most: the transaction update hands back result_id,
+    # and unlock_result flips is_paid only if nobody (webhook, reconciler,
+    # another poll) got there first.
+    transaction = await db.payment_transactions.find_one_and_update(
         {"session_id": session_id},
         {"$set": {
             "payment_status": status.payment_status,
             "status": status.status,
-            "updated_at": datetime.now(timezone.utc).isoformat()
-        }}
+            "updated_at": now
+        }},
+        projection={"_id": 0, "result_id": 1}
     )
     
-    if status.payment_status == "paid":
-        transaction = await db.payment_transactions.find_one(
-            {"session_id": session_id},
-            {"_id": 0}
-        )
-        if transaction and transaction.get("result_id"):
-            result = await db.quiz_results.find_one(
-                {"id": transaction["result_id"]},
-                {"_id": 0}
-            )
-            if result and not result.get("is_paid"):
-                await db.quiz_results.update_one(
-                    {"id": transaction["result_id"]},
-                    {"$set": {
-                        "is_paid": True,
-                        "paid_at": datetime.now(timezone.utc).isoformat()
-                    }}
-                )
+    if status.payment_status == "paid" and transaction and transaction.get("result_id"):
+        if await unlock_result(db, transaction["result_id"], now):
+            await publish_unlock(transaction["result_id"])
+        else:
+            await forget_result(transaction["result_id"])
+    
+    return status
+
+@api_router.get("/checkout/status/{session_id}", response_model=PaymentStatusResponse)
+async def get_checkout_status(session_id: str, http_request: Request):
+    gateway = get_payment_gateway(http_request)
+    
+    status = await checkout_status_checks.do(session_id, lambda: refresh_checkout_status(gateway, session_id))
     
     return {
         "status": status.status,
@@ -449,37 +587,27 @@ async def stripe_webhook(request: Request):
     body = await request.body()
     signature = request.headers.get("Stripe-Signature")
     
-    api_key = os.environ.get("STRIPE_API_KEY")
-    if not api_key:
-        raise HTTPException(status_code=500, detail="Payment not configured")
-    
-    host_url = str(request.base_url).rstrip('/')
-    webhook_url = f"{host_url}/api/webhook/stripe"
-    
-    stripe_checkout = StripeCheckout(api_key=api_key, webhook_url=webhook_url)
+    gateway = get_payment_gateway(request)
     
     try:
-        webhook_response = await stripe_checkout.handle_webhook(body, signature)
-        
-        if webhook_response.payment_status == "paid":
-            result_id = webhook_response.metadata.get("result_id")
-            if result_id:
-                await db.quiz_results.update_one(
-                    {"id": result_id},
-                    {"$set": {
-                        "is_paid": True,
-                        "paid_at": datetime.now(timezone.utc).isoformat()
-                    }}
-                )
-        
-        return {"status": "success"}
+        webhook_response = await gateway.handle_webhook(body, signature)
+    except PaymentGatewayTimeout:
+        raise
     except Exception as e:
+        # A bad signature or body won't get better on redelivery.
         logging.error(f"Webhook error: {e}")
         return {"status": "error", "message": str(e)}
+    try:
+        await webhook_pipeline.ingest(webhook_response)
+    except Exception as e:
+        # Not recorded: a non-2xx makes Stripe deliver the event again.
+        logging.error(f"Webhook not recorded: {e}")
+        raise HTTPException(status_code=503, detail="Webhook not recorded, please retry")
+    return {"status": "success"}
 
-@api_router.post("/results/email")
+@api_router.post("/results/email", dependencies=[Depends(rate_limited(email_limiter))])
 async def email_results(request: EmailResultsRequest):
-    result = await db.quiz_results.find_one({"id": request.result_id}, {"_id": 0})
+    result = await load_result(request.result_id)
     
     if not result:
         raise HTTPException(status_code=404, detail="Result not found")
@@ -487,16 +615,84 @@ async def email_results(request: EmailResultsRequest):
     if not result.get("is_paid"):
         raise HTTPException(status_code=403, detail="This feature requires unlocking full results")
     
-    await db.quiz_results.update_one(
-        {"id": request.result_id},
-        {"$set": {"emailed_to": request.email, "emailed_at": datetime.now(timezone.utc).isoformat()}}
-    )
+    await email_outbox.enqueue(request.result_id, request.email)
     
     return {"success": True, "message": f"Results will be sent to {request.email}"}
 
+@api_router.get("/admin/export", dependencies=[Depends(require_admin)])
+async def export_results(
+    format: str = "ndjson",
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    paid: Optional[bool] = None,
+    include: List[str] = Query([]),
+    limit: int = 0,
+    compress: bool = Query(False, alias="gzip")
+):
+    try:
+        chunks = export_stream(
+            db,
+            scoring_registry,
+            fmt=format,
+            compress=compress,
+            include=include,
+            since=since,
+            until=until,
+            paid=paid,
+            limit=limit
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    filename = f"quiz_results.{format}" + (".gz" if compress else "")
+    media_type = "application/gzip" if compress else ("text/csv" if format == "csv" else "application/x-ndjson")
+    return StreamingResponse(
+        chunks,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+@api_router.get("/admin/stats", dependencies=[Depends(require_admin)])
+async def get_result_stats():
+    return result_rollups.distribution()
+
+@api_router.get("/cache/stats")
+async def get_cache_stats():
+    return {"results": result_cache.stats()}
+
 # Include the router in the main app
 app.include_router(api_router)
 
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+REGISTRY.add_collector("result_cache", result_cache.stats)
+REGISTRY.add_collector("payment_events", payment_events.stats)
+REGISTRY.add_collector("webhook_pipeline", webhook_pipeline.stats)
+REGISTRY.add_collector("email_outbox", email_outbox.stats)
+REGISTRY.add_collector("result_loads", result_loads.stats)
+REGISTRY.add_collector("result_retention", result_retention.stats)
+REGISTRY.add_collector("rate_limit_submit", submit_limiter.stats)
+REGISTRY.add_collector("rate_limit_checkout", checkout_limiter.stats)
+REGISTRY.add_collector("rate_limit_email", email_limiter.stats)
+REGISTRY.add_collector("rate_limit_partner", partner_limiter.stats)
+REGISTRY.add_collector("checkout_status_checks", checkout_status_checks.stats)
+REGISTRY.add_collector("payment_gateway", lambda: payment_gateway.stats() if payment_gateway else {})
+if submission_buffer is not None:
+    REGISTRY.add_collector("submission_buffer", submission_buffer.stats)
+
+# Inside MetricsMiddleware so shed requests show up in the request metrics
+app.add_middleware(
+    AdmissionControlMiddleware,
+    max_concurrency=int(os.environ.get("MAX_CONCURRENT_REQUESTS", "256")),
+    max_queue=int(os.environ.get("MAX_QUEUED_REQUESTS", "512")),
+    queue_timeout=float(os.environ.get("ADMISSION_QUEUE_TIMEOUT_SECONDS", "5")),
+    max_streams=int(os.environ.get("MAX_EVENT_STREAMS", "1000")),
+)
+
+app.add_middleware(MetricsMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
@@ -512,6 +708,91 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@app.exception_handler(PaymentGatewayTimeout)
+async def payment_gateway_timeout_handler(request: Request, exc: PaymentGatewayTimeout):
+    return JSONResponse(status_code=504, content={"detail": "Payment provider timed out"})
+
+@app.exception_handler(PaymentGatewayUnavailable)
+async def payment_gateway_unavailable_handler(request: Request, exc: PaymentGatewayUnavailable):
+    retry_after = payment_gateway.breaker.reset_timeout if payment_gateway else 30
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Payment provider unavailable, please retry"},
+        headers={"Retry-After": str(max(1, int(retry_after)))}
+    )
+
+@app.exception_handler(FlightTimeout)
+async def flight_timeout_handler(request: Request, exc: FlightTimeout):
+    return JSONResponse(status_code=504, content={"detail": "Lookup timed out"})
+
+@app.exception_handler(WriteBehindFull)
+async def write_behind_full_handler(request: Request, exc: WriteBehindFull):
+    return JSONResponse(status_code=503, content={"detail": "Too many submissions, please retry"})
+
+@app.on_event("startup")
+async def startup_payment_gateway():
+    global payment_gateway
+    payment_gateway = create_payment_gateway(os.environ)
+
+@app.on_event("startup")
+async def startup_payment_reconciler():
+    await payment_reconciler.start()
+
+@app.on_event("shutdown")
+async def shutdown_payment_reconciler():
+    await payment_reconciler.stop()
+
+@app.on_event("startup")
+async def startup_indexes():
+    await ensure_indexes(db)
+
+@app.on_event("startup")
+async def startup_webhook_pipeline():
+    await webhook_pipeline.start()
+
+@app.on_event("startup")
+async def startup_result_rollups():
+    await result_rollups.start()
+
+@app.on_event("shutdown")
+async def shutdown_result_rollups():
+    await result_rollups.stop()
+
+@app.on_event("startup")
+async def startup_result_retention():
+    await result_retention.start()
+
+@app.on_event("shutdown")
+async def shutdown_result_retention():
+    await result_retention.stop()
+
+@app.on_event("startup")
+async def startup_email_outbox():
+    await email_outbox.start()
+
+@app.on_event("shutdown")
+async def shutdown_email_outbox():
+    await email_outbox.stop()
+
+@app.on_event("startup")
+async def startup_submission_buffer():
+    if submission_buffer is not None:
+        await submission_buffer.start()
+
+@app.on_event("shutdown")
+async def shutdown_submission_buffer():
+    if submission_buffer is not None:
+        await submission_buffer.stop()
+
+@app.on_event("shutdown")
+async def shutdown_webhook_pipeline():
+    await webhook_pipeline.stop()
+
+@app.on_event("shutdown")
+async def shutdown_payment_gateway():
+    if payment_gateway is not None:
+        await payment_gateway.close()
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
     client.close()
@@ -0,0 +1,75 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict
+
+from metrics import observe_single_flight
+
+logger = logging.getLogger(__name__)
+
+class FlightTimeout(Exception):
+    pass
+
+class SingleFlight:
+    """Collapses concurrent calls for the same key into one in-flight call.
+
+    The first caller for a key starts ``fn()`` as a task; callers arriving
+    while it runs await the same task instead of repeating the lookup. The
+    shared call is bounded by ``timeout`` seconds and raises FlightTimeout
+    to everyone waiting on it. A caller that is cancelled (client went away)
+    doesn't cancel the call for the others.
+
+    Only concurrent callers share a result; nothing is kept once the call
+    finishes.
+    """
+
+    def __init__(self, name: str, timeout: float = 10.0):
+        self.name = name
+        self.timeout = timeout
+        self._flights: Dict[str, asyncio.Task] = {}
+        self.calls = 0
+        self.collapsed = 0
+        self.timeouts = 0
+
+    async def _run(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        try:
+            return await asyncio.wait_for(fn(), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            observe_single_flight(self.name, "timeout")
+            raise FlightTimeout(f"{self.name} lookup for {key} took longer than {self.timeout}s")
+
+    def _done(self, key: str, task: asyncio.Task) -> None:
+        if self._flights.get(key) is task:
+            del self._flights[key]
+        if not task.cancelled():
+            # Retrieved here so a failure nobody awaited isn't logged as lost.
+            task.exception()
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        self.calls += 1
+        task = self._flights.get(key)
+        if task is None:
+            observe_single_flight(self.name, "leader")
+            task = asyncio.create_task(self._run(key, fn))
+            self._flights[key] = task
+            task.add_done_callback(lambda done: self._done(key, done))
+        else:
+            self.collapsed += 1
+            observe_single_flight(self.name, "collapsed")
+        return await asyncio.shield(task)
+
+    def forget(self, key: str) -> None:
+        """Make the next caller for ``key`` start a fresh call.
+
+        For when the underlying data just changed: callers already waiting
+        keep the in-flight call, later ones don't join it.
+        """
+        self._flights.pop(key, None)
+
+    def stats(self) -> Dict:
+        return {
+            "in_flight": len(self._flights),
+            "calls": self.calls,
+            "collapsed": self.collapsed,
+            "timeouts": self.timeouts,
+        }
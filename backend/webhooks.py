@@ -0,0 +1,200 @@
+import asyncio
+import logging
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Dict, List, Optional, Set
+
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+async def unlock_result(db, result_id: str, paid_at: str) -> bool:
+    """Mark one result paid; True only for the call that flipped ``is_paid``.
+
+    The unpaid check is part of the update filter, so when the status route,
+    the webhook and the reconciler race on the same payment exactly one of
+    them sees True and publishes the unlock. ``$ne: True`` rather than
+    ``False`` also matches results stored before ``is_paid`` existed.
+    Retention leaves results with a recent ``checkout_started_at`` alone, so
+    a result being paid for is always in quiz_results.
+    """
+    before = await db.quiz_results.find_one_and_update(
+        {"id": result_id, "is_paid": {"$ne": True}},
+        {"$set": {"is_paid": True, "paid_at": paid_at}},
+        projection={"_id": 0, "id": 1}
+    )
+    return before is not None
+
+async def unlock_results(
+    db,
+    result_ids: List[str],
+    paid_at: str,
+    concurrency: int = 10,
+) -> List[str]:
+    """Mark results paid, ``concurrency`` at a time; returns the ids this call unlocked."""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def unlock(result_id: str) -> bool:
+        async with semaphore:
+            return await unlock_result(db, result_id, paid_at)
+
+    unlocked = await asyncio.gather(*(unlock(result_id) for result_id in result_ids))
+    return [result_id for result_id, done in zip(result_ids, unlocked) if done]
+
+async def notify_unlocked(on_unlock: Callable[[str], Awaitable[None]], result_ids: List[str]) -> None:
+    """Run ``on_unlock`` for each id; one failure doesn't skip the rest."""
+    for result_id in result_ids:
+        try:
+            await on_unlock(result_id)
+        except Exception as e:
+            logger.error(f"Unlock hook failed for result {result_id}: {e}")
+
+class WebhookPipeline:
+    """Records payment webhooks once and applies them off the request path.
+
+    ``ingest`` stores the event under a unique ``event_id`` (see indexes.py)
+    and queues it; redelivered events hit the unique index and are dropped.
+    Workers drain the queue in batches and unlock each batch's results with
+    conditional updates (see ``unlock_result``), a few at a time, and call
+    ``on_unlock`` for the results they unlocked and ``on_paid`` (if given)
+    for paid results another process had already unlocked. Events
+    still ``pending`` (left over from a restart, or from a batch that
+    failed) are re-queued in the background on start and then every
+    ``retry_interval`` seconds.
+    """
+
+    def __init__(
+        self,
+        db,
+        on_unlock: Callable[[str], Awaitable[None]],
+        workers: int = 2,
+        batch_size: int = 100,
+        max_queue: int = 10000,
+        retry_interval: float = 60.0,
+        on_paid: Optional[Callable[[str], Awaitable[None]]] = None,
+    ):
+        self.db = db
+        self.on_unlock = on_unlock
+        self.on_paid = on_paid
+        self.workers = workers
+        self.batch_size = batch_size
+        self.retry_interval = retry_interval
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
+        self._queued: Set[str] = set()
+        self._tasks: List[asyncio.Task] = []
+        self.requeued = 0
+        self.received = 0
+        self.duplicates = 0
+        self.processed = 0
+        self.batches = 0
+        self.failures = 0
+
+    async def start(self) -> None:
+        # Workers first: recovery may queue more events than fit at once.
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._recover()))
+
+    async def _enqueue(self, event: Dict) -> None:
+        if event["event_id"] in self._queued:
+            return
+        self._queued.add(event["event_id"])
+        await self._queue.put(event)
+
+    async def requeue_pending(self) -> int:
+        """Queue pending events that aren't queued already; returns how many."""
+        count = 0
+        async for event in self.db.webhook_events.find({"status": "pending"}, {"_id": 0}):
+            if event["event_id"] not in self._queued:
+                await self._enqueue(event)
+                count += 1
+        self.requeued += count
+        return count
+
+    async def _recover(self) -> None:
+        while True:
+            try:
+                count = await self.requeue_pending()
+                if count:
+                    logger.info(f"Re-queued {count} pending webhook events")
+            except Exception as e:
+                logger.error(f"Webhook recovery failed: {e}")
+            await asyncio.sleep(self.retry_interval)
+
+    async def stop(self, timeout: float = 5.0) -> None:
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Stopping webhook workers with {self._queue.qsize()} events queued")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def ingest(self, webhook_response) -> bool:
+        metadata = getattr(webhook_response, "metadata", None) or {}
+        event_id = webhook_response.event_id or f"{webhook_response.session_id}:{webhook_response.payment_status}"
+        event = {
+            "event_id": event_id,
+            "event_type": webhook_response.event_type,
+            "session_id": webhook_response.session_id,
+            "payment_status": webhook_response.payment_status,
+            "result_id": metadata.get("result_id"),
+            "status": "pending",
+            "received_at": datetime.now(timezone.utc).isoformat()
+        }
+        self.received += 1
+        try:
+            await self.db.webhook_events.insert_one(event)
+        except DuplicateKeyError:
+            self.duplicates += 1
+            return False
+        event.pop("_id", None)
+        await self._enqueue(event)
+        return True
+
+    async def _worker(self) -> None:
+        while True:
+            batch = [await self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except asyncio.QueueEmpty:
+                    break
+            try:
+                await self._process(batch)
+            except Exception as e:
+                # Events stay pending in webhook_events; recovery queues
+                # them again.
+                self.failures += 1
+                logger.error(f"Webhook batch of {len(batch)} failed: {e}")
+            finally:
+                for event in batch:
+                    self._queued.discard(event["event_id"])
+                    self._queue.task_done()
+
+    async def _process(self, batch: List[Dict]) -> None:
+        now = datetime.now(timezone.utc).isoformat()
+        paid_ids = list(dict.fromkeys(
+            event["result_id"] for event in batch
+            if event["payment_status"] == "paid" and event.get("result_id")
+        ))
+        unlock_ids = await unlock_results(self.db, paid_ids, now)
+        await self.db.webhook_events.update_many(
+            {"event_id": {"$in": [event["event_id"] for event in batch]}},
+            {"$set": {"status": "processed", "processed_at": now}}
+        )
+        self.processed += len(batch)
+        self.batches += 1
+        await notify_unlocked(self.on_unlock, unlock_ids)
+        if self.on_paid is not None:
+            await notify_unlocked(self.on_paid, [result_id for result_id in paid_ids if result_id not in unlock_ids])
+
+    def stats(self) -> Dict:
+        return {
+            "queued": self._queue.qsize(),
+            "received": self.received,
+            "duplicates": self.duplicates,
+            "requeued": self.requeued,
+            "processed": self.processed,
+            "batches": self.batches,
+            "failures": self.failures,
+        }
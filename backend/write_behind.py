@@ -0,0 +1,190 @@
+import asyncio
+import logging
+from typing import Dict, List, Optional
+
+from pymongo.errors import BulkWriteError
+
+logger = logging.getLogger(__name__)
+
+DUPLICATE_KEY = 11000
+
+class WriteBehindFull(Exception):
+    pass
+
+class WriteBehindBuffer:
+    """Acknowledges inserts once buffered and writes them with insert_many.
+
+    Documents (keyed by their ``id``) wait in memory until ``batch_size`` of
+    them are pending or ``flush_interval`` seconds have passed since the first
+    one, then a background flusher writes them in one unordered
+    ``insert_many``. ``get`` serves buffered documents so readers see their
+    own writes before the flush.
+
+    Durability knobs: with ``flush_when_full`` a submission arriving at a full
+    buffer flushes synchronously; otherwise it waits up to ``full_timeout``
+    for the flusher to make room. ``flush_on_shutdown`` drains the buffer in
+    ``stop``. Documents still buffered when the process dies are lost.
+    """
+
+    def __init__(
+        self,
+        collection,
+        max_pending: int = 10000,
+        batch_size: int = 500,
+        flush_interval: float = 0.05,
+        flush_when_full: bool = True,
+        flush_on_shutdown: bool = True,
+        full_timeout: float = 5.0,
+    ):
+        self.collection = collection
+        self.max_pending = max_pending
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.flush_when_full = flush_when_full
+        self.flush_on_shutdown = flush_on_shutdown
+        self.full_timeout = full_timeout
+        self._pending: Dict[str, Dict] = {}
+        self._inflight: Dict[str, Dict] = {}
+        self._flush_lock = asyncio.Lock()
+        self._has_pending = asyncio.Event()
+        self._batch_ready = asyncio.Event()
+        self._room = asyncio.Event()
+        self._room.set()
+        self._task: Optional[asyncio.Task] = None
+        self.buffered = 0
+        self.flushed = 0
+        self.batches = 0
+        self.sync_flushes = 0
+        self.failures = 0
+
+    def __len__(self) -> int:
+        return len(self._pending) + len(self._inflight)
+
+    async def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self.flush_on_shutdown:
+            await self.flush()
+        if len(self):
+            logger.warning(f"Stopping with {len(self)} buffered submissions unwritten")
+
+    async def add(self, doc: Dict) -> None:
+        if len(self) >= self.max_pending:
+            if self.flush_when_full:
+                self.sync_flushes += 1
+                try:
+                    await self.flush()
+                except Exception as e:
+                    logger.error(f"Write-behind flush failed: {e}")
+            else:
+                try:
+                    await asyncio.wait_for(self._room.wait(), timeout=self.full_timeout)
+                except asyncio.TimeoutError:
+                    pass
+            if len(self) >= self.max_pending:
+                raise WriteBehindFull(f"{len(self)} submissions waiting to be written")
+
+        self._pending[doc["id"]] = doc
+        self.buffered += 1
+        self._has_pending.set()
+        if len(self._pending) >= self.batch_size:
+            self._batch_ready.set()
+        if len(self) >= self.max_pending:
+            self._room.clear()
+
+    def get(self, doc_id: str) -> Optional[Dict]:
+        doc = self._pending.get(doc_id) or self._inflight.get(doc_id)
+        if doc is None:
+            return None
+        # insert_many adds the ObjectId to documents it has sent.
+        return {key: value for key, value in doc.items() if key != "_id"}
+
+    def is_buffered(self, doc_id: str) -> bool:
+        return doc_id in self._pending or doc_id in self._inflight
+
+    async def ensure_written(self, doc_id: str) -> None:
+        """Flush now if ``doc_id`` is still buffered (e.g. before a payment)."""
+        if self.is_buffered(doc_id):
+            await self.flush()
+
+    async def _run(self) -> None:
+        while True:
+            await self._has_pending.wait()
+            try:
+                await asyncio.wait_for(self._batch_ready.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await self.flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Write-behind flush failed: {e}")
+                await asyncio.sleep(self.flush_interval)
+
+    async def flush(self) -> None:
+        async with self._flush_lock:
+            while self._pending:
+                batch_ids = list(self._pending)[:self.batch_size]
+                for doc_id in batch_ids:
+                    self._inflight[doc_id] = self._pending.pop(doc_id)
+                self._update_events()
+                # Until _write returns, the whole batch counts as failed, so an
+                # error or a cancellation (shutdown) puts it back.
+                failed = batch_ids
+                try:
+                    failed = await self._write([self._inflight[doc_id] for doc_id in batch_ids])
+                finally:
+                    # Failed documents go back to the front of the buffer.
+                    retry = {doc_id: self._inflight.pop(doc_id) for doc_id in failed}
+                    for doc_id in batch_ids:
+                        self._inflight.pop(doc_id, None)
+                    if retry:
+                        self.failures += 1
+                        self._pending = {**retry, **self._pending}
+                    self._update_events()
+                if retry:
+                    return
+
+    async def _write(self, docs: List[Dict]) -> List[str]:
+        """insert_many the batch; returns the ids that need another attempt."""
+        try:
+            await self.collection.insert_many(docs, ordered=False)
+        except BulkWriteError as e:
+            failed = [
+                docs[error["index"]]["id"] for error in e.details.get("writeErrors", [])
+                if error.get("code") != DUPLICATE_KEY
+            ]
+            # A duplicate means an earlier attempt already wrote the document.
+            self.flushed += len(docs) - len(failed)
+            self.batches += 1
+            if failed:
+                logger.error(f"Write-behind insert failed for {len(failed)} of {len(docs)} submissions")
+            return failed
+        self.flushed += len(docs)
+        self.batches += 1
+        return []
+
+    def _update_events(self) -> None:
+        if not self._pending:
+            self._has_pending.clear()
+        if len(self._pending) < self.batch_size:
+            self._batch_ready.clear()
+        if len(self) < self.max_pending:
+            self._room.set()
+
+    def stats(self) -> Dict:
+        return {
+            "pending": len(self._pending),
+            "inflight": len(self._inflight),
+            "buffered": self.buffered,
+            "flushed": self.flushed,
+            "batches": self.batches,
+            "sync_flushes": self.sync_flushes,
+            "failures": self.failures,
+        }
@@ -98,35 +98,21 @@ export default function ResultsPage() {
     }
   }, [resultId]);
 
-  const pollPaymentStatus = useCallback(async (sid, attempts = 0) => {
-    const maxAttempts = 10;
-    const pollInterval = 2000;
+  // Resolves true once the checkout is settled (paid or expired).
+  const checkPaymentStatus = useCallback(async (sid) => {
+    const response = await axios.get(`${API}/checkout/status/${sid}`);
 
-    if (attempts >= maxAttempts) {
+    if (response.data.payment_status === "paid") {
       setIsCheckingPayment(false);
-      toast.error("Payment verification timed out. Please refresh the page.");
-      return;
-    }
-
-    try {
-      const response = await axios.get(`${API}/checkout/status/${sid}`);
-
-      if (response.data.payment_status === "paid") {
-        setIsCheckingPayment(false);
-        toast.success("Payment successful! Unlocking your full analysis...");
-        fetchResults();
-        return;
-      } else if (response.data.status === "expired") {
-        setIsCheckingPayment(false);
-        toast.error("Payment session expired. Please try again.");
-        return;
-      }
-
-      setTimeout(() => pollPaymentStatus(sid, attempts + 1), pollInterval);
-    } catch (error) {
-      console.error("Error checking payment status:", error);
+      toast.success("Payment successful! Unlocking your full analysis...");
+      fetchResults();
+      return true;
+    } else if (response.data.status === "expired") {
       setIsCheckingPayment(false);
+      toast.error("Payment session expired. Please try again.");
+      return true;
     }
+    return false;
   }, [fetchResults]);
 
   useEffect(() => {
@@ -134,11 +120,68 @@ export default function ResultsPage() {
   }, [fetchResults]);
 
   useEffect(() => {
-    if (sessionId && !isPaid) {
-      setIsCheckingPayment(true);
-      pollPaymentStatus(sessionId);
+    if (!sessionId || isPaid) {
+      return undefined;
     }
-  }, [sessionId, isPaid, pollPaymentStatus]);
+
+    let source = null;
+    let cancelled = false;
+
+    const finalCheck = async () => {
+      try {
+        if (!cancelled && !(await checkPaymentStatus(sessionId))) {
+          setIsCheckingPayment(false);
+          toast.error("Payment verification timed out. Please refresh the page.");
+        }
+      } catch (error) {
+        console.error("Error checking payment status:", error);
+        setIsCheckingPayment(false);
+      }
+    };
+
+    // Check the session once, then wait on the server's event stream for the
+    // webhook to unlock the result instead of polling the payment provider.
+    const waitForPayment = async () => {
+      setIsCheckingPayment(true);
+      try {
+        if (await checkPaymentStatus(sessionId)) {
+          return;
+        }
+      } catch (error) {
+        console.error("Error checking payment status:", error);
+        setIsCheckingPayment(false);
+        return;
+      }
+      if (cancelled) {
+        return;
+      }
+
+      source = new EventSource(`${API}/results/${resultId}/events`);
+      source.addEventListener("paid", () => {
+        source.close();
+        setIsCheckingPayment(false);
+        toast.success("Payment successful! Unlocking your full analysis...");
+        fetchResults();
+      });
+      source.addEventListener("timeout", () => {
+        source.close();
+        finalCheck();
+      });
+      source.onerror = () => {
+        source.close();
+        finalCheck();
+      };
+    };
+
+    waitForPayment();
+
+    return () => {
+      cancelled = true;
+      if (source) {
+        source.close();
+      }
+    };
+  }, [sessionId, isPaid, resultId, checkPaymentStatus, fetchResults]);
 
   const handleUnlock = async () => {
     setIsProcessingCheckout(true);
@@ -0,0 +1,50 @@
+import asyncio
+import os
+import sys
+import uuid
+from pathlib import Path
+
+import pytest
+from pymongo import MongoClient
+from pymongo.errors import PyMongoError
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from indexes import INDEXES, ensure_indexes, verify_query_plans  # noqa: E402
+
+MONGO_URL = os.environ.get("MONGO_URL", "mongodb://localhost:27017")
+
+def _mongod_reachable() -> bool:
+    client = MongoClient(MONGO_URL, serverSelectionTimeoutMS=1000)
+    try:
+        client.admin.command("ping")
+        return True
+    except PyMongoError:
+        return False
+    finally:
+        client.close()
+
+pytestmark = pytest.mark.skipif(not _mongod_reachable(), reason=f"no mongod reachable at {MONGO_URL}")
+
+def test_route_queries_use_indexes():
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    db_name = f"test_indexes_{uuid.uuid4().hex[:8]}"
+
+    async def run():
+        client = AsyncIOMotorClient(MONGO_URL)
+        try:
+            db = client[db_name]
+            await ensure_indexes(db)
+            # Running twice must be a no-op.
+            await ensure_indexes(db)
+            for collection, indexes in INDEXES.items():
+                names = set(await db[collection].index_information())
+                assert {index.document["name"] for index in indexes} <= names
+            return await verify_query_plans(db)
+        finally:
+            await client.drop_database(db_name)
+            client.close()
+
+    plans = asyncio.run(run())
+    assert all("COLLSCAN" not in stages for stages in plans.values())
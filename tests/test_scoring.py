@@ -0,0 +1,242 @@
+import functools
+import itertools
+import json
+import sys
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from scoring import SPEC_DIR, ScoringEngine  # noqa: E402
+
+# The hard-coded rules scoring_specs/v1.json replaced, kept verbatim as the
+# reference the spec must reproduce.
+
+def compute_scores(answers: List[int]) -> Dict:
+    ax = sum(answers[0:4])
+    av = sum(answers[4:8])
+    q13r = 6 - answers[12]
+    q14r = 6 - answers[13]
+    cr = answers[8] + answers[9] + answers[10] + answers[11] + q13r + q14r + answers[14] + answers[15]
+    ps = sum(answers[16:25])
+    return {"ax": ax, "av": av, "cr": cr, "ps": ps}
+
+def tag_attachment(score: int) -> str:
+    if score >= 14:
+        return "High"
+    if score >= 10:
+        return "Moderate"
+    return "Low"
+
+def tag_cr(score: int) -> str:
+    if score >= 28:
+        return "High"
+    if score >= 18:
+        return "Moderate"
+    return "Low"
+
+def tag_ps(score: int) -> str:
+    if score >= 33:
+        return "High"
+    if score >= 21:
+        return "Moderate"
+    return "Low"
+
+def attachment_style(ax: int, av: int) -> str:
+    ax_high = ax >= 14
+    av_high = av >= 14
+    if ax_high and not av_high:
+        return "Anxious-leaning"
+    if not ax_high and av_high:
+        return "Avoidant-leaning"
+    if ax_high and av_high:
+        return "Fearful-avoidant (push-pull)"
+    return "More secure-leaning"
+
+def primary_archetype(attach: str) -> str:
+    if attach.startswith("Anxious"):
+        return "The Chaser"
+    if attach.startswith("Avoidant"):
+        return "The Escape Artist"
+    if attach.startswith("Fearful"):
+        return "The Push-Pull Magnet"
+    return "Secure Builder"
+
+def modifiers(volcano: bool, picker: bool) -> List[str]:
+    mods = []
+    if picker:
+        mods.append("Pattern Picker")
+    if volcano:
+        mods.append("Volcano")
+    return mods
+
+def result_label(primary: str, mods: List[str]) -> str:
+    label = primary
+    if mods:
+        label += " + " + " + ".join(mods)
+    return label
+
+def build_blocks(primary: str, volcano: bool, picker: bool) -> Dict:
+    base = {
+        "The Chaser": {
+            "what": "You bond fast and chase clarity when connection feels uncertain. That urgency can pressure the relationship, especially if the other person is inconsistent or emotionally limited.",
+            "steps": [
+                "Use a 24-hour rule when activated: pause before big texts, decisions, or ultimatums.",
+                "Replace reassurance-seeking with one clear ask: Can we talk tonight? I want closeness and clarity.",
+                "Date for consistency, not intensity: track follow-through and effort over time."
+            ],
+            "script": "I'm feeling activated. I want clarity, not a fight. Let's talk when we're both calm."
+        },
+        "The Escape Artist": {
+            "what": "When things get real, you default to distance. Partners feel shut out, and tough conversations become too much, so connection erodes quietly.",
+            "steps": [
+                "Practice micro-vulnerability daily: one honest sentence instead of disappearing.",
+                "Use a scripted pause and return: I'm flooded. I care. I need 30 minutes and I'm coming back.",
+                "Turn toward bids for connection: small responses build safety fast."
+            ],
+            "script": "I'm overwhelmed. I care about us. I'm taking 30 minutes, then I'll come back to repair."
+        },
+        "The Push-Pull Magnet": {
+            "what": "You want closeness and fear it at the same time. You can bond fast, then doubt, then test, then detach. That creates instability even when feelings are real.",
+            "steps": [
+                "Slow the runway: no major commitments for 6-8 weeks - consistency first.",
+                "Replace tests with direct needs: say the need instead of provoking a reaction.",
+                "Use gentle start-ups and repair attempts early in conflict."
+            ],
+            "script": "I want closeness, and I'm getting scared. I'm going to be direct instead of testing."
+        },
+        "Secure Builder": {
+            "what": "You're relatively secure. If things go wrong, it's usually selection (who you pick), timing, or skill mismatch - not your capacity to love.",
+            "steps": [
+                "State your needs early and watch behavior - not promises.",
+                "Keep standards: consistency and repair matter more than chemistry.",
+                "If conflict repeats, implement a repair ritual or exit cleanly."
+            ],
+            "script": "I'm open to working on this - if we can repair and change the pattern."
+        }
+    }
+    
+    out = base.get(primary, base["Secure Builder"]).copy()
+    out["steps"] = out["steps"].copy()
+    
+    if picker:
+        out["what"] += " You also tend to override your standards when chemistry is strong - then you stay too long hoping potential becomes reality."
+        out["steps"].insert(0, "Create 5 non-negotiables and enforce them. Consistency is the gate; potential does not count.")
+        out["steps"].append("Use an evidence log: if the same red flag appears twice, you exit - no negotiating with the pattern.")
+    
+    if volcano:
+        out["what"] += " Conflict is the multiplier: arguments escalate, repair gets missed, and disconnection follows."
+        out["steps"].insert(0, "Ban the big four in your house: contempt, criticism, defensiveness, stonewalling. Replace with behavior + feeling + need.")
+        out["steps"].append("Install a repair protocol: pause, return, name feeling, make one request, agree on one change.")
+        out["script"] = "I'm activated. I'm pausing so I don't say something I can't take back. I will come back to repair."
+    
+    out["steps"] = out["steps"][:6]
+    return out
+
+def compute_full_results(answers: List[int]) -> Dict:
+    scores = compute_scores(answers)
+    ax, av, cr, ps = scores["ax"], scores["av"], scores["cr"], scores["ps"]
+    
+    attach = attachment_style(ax, av)
+    primary = primary_archetype(attach)
+    volcano = cr >= 28
+    picker = ps >= 33
+    mods = modifiers(volcano, picker)
+    label = result_label(primary, mods)
+    
+    blocks = build_blocks(primary, volcano, picker)
+    
+    return {
+        "scores": {
+            "ax": ax,
+            "av": av,
+            "cr": cr,
+            "ps": ps,
+            "ax_tag": tag_attachment(ax),
+            "av_tag": tag_attachment(av),
+            "cr_tag": tag_cr(cr),
+            "ps_tag": tag_ps(ps)
+        },
+        "label": label,
+        "primary": primary,
+        "mods": mods,
+        "attach": attach,
+        "volcano": volcano,
+        "picker": picker,
+        "what": blocks["what"],
+        "steps": blocks["steps"],
+        "script": blocks["script"]
+    }
+
+def compute_teaser_results(answers: List[int]) -> Dict:
+    scores = compute_scores(answers)
+    ax, av, cr, ps = scores["ax"], scores["av"], scores["cr"], scores["ps"]
+    
+    attach = attachment_style(ax, av)
+    primary = primary_archetype(attach)
+    mods = modifiers(cr >= 28, ps >= 33)
+    label = result_label(primary, mods)
+    
+    return {
+        "scores": {
+            "ax": ax,
+            "av": av,
+            "cr": cr,
+            "ps": ps,
+            "ax_tag": tag_attachment(ax),
+            "av_tag": tag_attachment(av),
+            "cr_tag": tag_cr(cr),
+            "ps_tag": tag_ps(ps)
+        },
+        "label": label,
+        "primary": primary,
+        "mods": mods,
+        "attach": attach,
+        "teaser_what": teaser_what(primary),
+        "teaser_tip": TEASER_TIP
+    }
+
+def teaser_what(primary: str) -> str:
+    return f"As a {primary}, you have specific patterns in how you connect with others..."
+
+TEASER_TIP = "Unlock your full analysis to discover what tends to go wrong and exactly how to improve."
+
+@functools.lru_cache(maxsize=None)
+def _fill(count: int, total: int, reverse: Tuple[int, ...] = ()) -> Tuple[int, ...]:
+    """``count`` answers between 1 and 5 whose score (with the items at
+    ``reverse`` reverse-scored) is ``total``."""
+    values = [1] * count
+    extra = total - count
+    for i in range(count):
+        step = min(4, extra)
+        values[i] += step
+        extra -= step
+    return tuple(6 - value if i in reverse else value for i, value in enumerate(values))
+
+def _answers_for(ax: int, av: int, cr: int, ps: int) -> List[int]:
+    # Q13 and Q14 (the 5th and 6th conflict items) are reverse-scored.
+    return list(_fill(4, ax) + _fill(4, av) + _fill(8, cr, (4, 5)) + _fill(9, ps))
+
+def _plain(payload: Dict) -> Dict:
+    # The shared payloads hold tuples; the API serializes them as lists.
+    return {key: list(value) if isinstance(value, tuple) else value for key, value in payload.items()}
+
+def test_v1_spec_reproduces_the_hard_coded_rules():
+    with open(SPEC_DIR / "v1.json") as f:
+        engine = ScoringEngine(json.load(f))
+    combos = list(itertools.product(range(4, 21), range(4, 21), range(8, 41), range(9, 46)))
+    assert len(combos) == 352869
+    answers = [_answers_for(*combo) for combo in combos]
+
+    batch = engine.iter_results(engine.score_matrix(np.array(answers)))
+    for combo, row, batched in zip(combos, answers, batch):
+        expected_full = compute_full_results(row)
+        expected_teaser = compute_teaser_results(row)
+        assert [expected_full["scores"][key] for key in ("ax", "av", "cr", "ps")] == list(combo)
+        scored = engine.score(row)
+        assert _plain(scored.full) == expected_full
+        assert _plain(scored.teaser) == expected_teaser
+        assert _plain(batched.full) == expected_full
+        assert _plain(batched.teaser) == expected_teaser
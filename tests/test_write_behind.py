@@ -0,0 +1,78 @@
+import asyncio
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from write_behind import WriteBehindBuffer, WriteBehindFull  # noqa: E402
+
+class StubCollection:
+    """insert_many stand-in; ``gate``, when set, holds every call until it's set."""
+
+    def __init__(self, gate=None):
+        self.gate = gate
+        self.docs = {}
+        self.calls = 0
+        self.started = asyncio.Event()
+
+    async def insert_many(self, docs, ordered=True):
+        self.calls += 1
+        self.started.set()
+        if self.gate is not None:
+            await self.gate.wait()
+        for doc in docs:
+            self.docs[doc["id"]] = dict(doc)
+
+def test_stop_during_flush_writes_everything():
+    async def run():
+        collection = StubCollection(gate=asyncio.Event())
+        buffer = WriteBehindBuffer(collection, batch_size=2, flush_interval=0.01)
+        await buffer.start()
+        for i in range(3):
+            await buffer.add({"id": str(i)})
+        await asyncio.wait_for(collection.started.wait(), timeout=1)
+        # The first batch is in flight when shutdown cancels the flusher.
+        collection.gate = None
+        await asyncio.wait_for(buffer.stop(), timeout=1)
+        return collection, buffer
+
+    collection, buffer = asyncio.run(run())
+    assert set(collection.docs) == {"0", "1", "2"}
+    assert len(buffer) == 0
+    assert buffer.get("0") is None
+
+def test_full_buffer_flushes_synchronously():
+    async def run():
+        collection = StubCollection()
+        buffer = WriteBehindBuffer(collection, max_pending=2, batch_size=10, flush_interval=60)
+        for i in range(3):
+            await buffer.add({"id": str(i)})
+        return collection, buffer
+
+    collection, buffer = asyncio.run(run())
+    assert set(collection.docs) == {"0", "1"}
+    assert buffer.sync_flushes == 1
+    assert buffer.get("2") == {"id": "2"}
+
+def test_full_buffer_waits_for_room_then_rejects():
+    async def run():
+        collection = StubCollection(gate=asyncio.Event())
+        buffer = WriteBehindBuffer(
+            collection, max_pending=2, batch_size=2, flush_interval=0.01, flush_when_full=False, full_timeout=0.05
+        )
+        await buffer.start()
+        await buffer.add({"id": "0"})
+        await buffer.add({"id": "1"})
+        await asyncio.wait_for(collection.started.wait(), timeout=1)
+        # The flusher holds both slots until the write completes.
+        with pytest.raises(WriteBehindFull):
+            await buffer.add({"id": "2"})
+        collection.gate.set()
+        await buffer.add({"id": "3"})
+        await buffer.stop()
+        return collection
+
+    collection = asyncio.run(run())
+    assert set(collection.docs) == {"0", "1", "3"}